@@ -0,0 +1,467 @@
+"""Benchmark del motore batch su fixture sintetiche generate con ffmpeg (lavfi)
+
+Uso:
+    python benchmark.py                      # worker 1, 2 e numero di CPU
+    python benchmark.py -j 1 -j 4 --repeat 3
+    python benchmark.py --compare .benchmark/results-20240101-120000.json
+    python benchmark.py --startup --repeat 5  # tempi di avvio di CLI e GUI
+    python benchmark.py --check-engines       # motore numpy contro loudnorm
+
+Ogni configurazione gira in un processo Python separato, così il picco di
+memoria (RSS) misurato appartiene solo a quella esecuzione. I risultati sono
+salvati in JSON per confrontare le esecuzioni e individuare regressioni.
+
+Con --startup si misura invece l'avvio a freddo dell'interprete: import del
+modulo, CLI headless su una cartella vuota e GUI fino all'esito della verifica
+di ffmpeg, sia con la cache dei probe di ffmpeg vuota sia già popolata.
+
+Con --check-engines le fixture (più una dinamica e una 5.1) vengono misurate
+con entrambi i motori di analisi: l'uscita è 1 se gli scarti superano
+ENGINE_TOLERANCES.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import statistics
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import List, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import normalize_music
+from normalize_music import MusicNormalizer, BatchEngine, PcmBudget
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+# Fixture deterministiche: (nome, durata 'short'/'long', sorgente lavfi, argomenti di codifica)
+FIXTURES = [
+    ('sine_short.mp3', 'short', 'sine=frequency=440:sample_rate=44100',
+     ['-ac', '2', '-c:a', 'libmp3lame', '-b:a', '192k']),
+    ('noise_short.flac', 'short', 'anoisesrc=color=pink:amplitude=0.05:sample_rate=44100:seed={seed}',
+     ['-c:a', 'flac']),
+    ('sine_short.wav', 'short', 'sine=frequency=1000:sample_rate=48000',
+     ['-c:a', 'pcm_s16le']),
+    ('noise_long.m4a', 'long', 'anoisesrc=color=pink:amplitude=0.2:sample_rate=44100:seed={seed}',
+     ['-ac', '2', '-c:a', 'aac', '-b:a', '192k']),
+    ('sine_long.opus', 'long', 'sine=frequency=220:sample_rate=48000',
+     ['-c:a', 'libopus', '-b:a', '128k']),
+    ('noise_long.ogg', 'long', 'anoisesrc=color=brown:amplitude=0.1:sample_rate=44100:seed={seed}',
+     ['-c:a', 'libvorbis', '-q:a', '5']),
+]
+# Video con audio: sorgente video testsrc a bassa risoluzione
+VIDEO_FIXTURE = ('video_short.mp4', 'short')
+
+# Fixture aggiuntive del confronto tra motori: (nome, sorgente lavfi, argomenti)
+ENGINE_FIXTURES = [
+    # Rumore rosa che alterna 5 s a pieno livello e 5 s a -26 dB
+    ('dynamic.flac', 'anoisesrc=color=pink:amplitude=0.3:seed=3:duration=60',
+     ['-af', "volume='if(lt(mod(t,10),5),1,0.05)':eval=frame", '-c:a', 'flac']),
+    ('surround.flac', 'anoisesrc=color=pink:amplitude=0.1:seed=4:duration=30',
+     ['-ac', '6', '-c:a', 'flac']),
+]
+# Scarto massimo del motore numpy: integrated (LU) e true peak (dB) rispetto a
+# loudnorm, LRA (LU) rispetto a ebur128. L'LRA di loudnorm non applica il gate
+# relativo di EBU 3342 come ebur128 e diverge sul materiale molto dinamico
+ENGINE_TOLERANCES = {'input_i': 0.2, 'input_tp': 0.2, 'input_lra': 0.5}
+
+
+def generate_fixtures(ffmpeg_path: str, fixture_dir: Path, copies: int,
+                      short: float, long: float) -> List[Path]:
+    """Genera le fixture (riusate se già presenti con la stessa specifica)"""
+    spec = {'copies': copies, 'short': short, 'long': long,
+            'fixtures': [name for name, *_ in FIXTURES] + [VIDEO_FIXTURE[0]]}
+    spec_file = fixture_dir / 'fixtures.json'
+    if spec_file.exists() and json.loads(spec_file.read_text()) == spec:
+        return sorted(p for p in fixture_dir.iterdir() if p.name != 'fixtures.json')
+
+    if fixture_dir.exists():
+        shutil.rmtree(fixture_dir)
+    fixture_dir.mkdir(parents=True)
+    durations = {'short': short, 'long': long}
+    for copy in range(copies):
+        for name, length, source, codec_args in FIXTURES:
+            # Livello diverso per copia: i file richiedono guadagni diversi
+            level = -6 - 4 * copy
+            output = fixture_dir / f'{copy:02d}_{name}'
+            cmd = [ffmpeg_path, '-v', 'error', '-f', 'lavfi',
+                   '-i', f'{source.format(seed=copy + 1)}:duration={durations[length]}',
+                   '-af', f'volume={level}dB', *codec_args, '-y', str(output)]
+            subprocess.run(cmd, check=True)
+        name, length = VIDEO_FIXTURE
+        cmd = [ffmpeg_path, '-v', 'error',
+               '-f', 'lavfi', '-i', f'testsrc=size=320x240:rate=25:duration={durations[length]}',
+               '-f', 'lavfi', '-i', f'sine=frequency=660:sample_rate=48000:duration={durations[length]}',
+               '-af', f'volume={-10 - 4 * copy}dB',
+               '-c:v', 'mpeg4', '-q:v', '10', '-c:a', 'aac', '-b:a', '128k',
+               '-y', str(fixture_dir / f'{copy:02d}_{name}')]
+        subprocess.run(cmd, check=True)
+    spec_file.write_text(json.dumps(spec, indent=2))
+    return sorted(p for p in fixture_dir.iterdir() if p.name != 'fixtures.json')
+
+
+def peak_rss_mb():
+    """Picco RSS (MB) del processo e del più grande processo figlio (ffmpeg)"""
+    if resource is None:
+        return None, None
+    # ru_maxrss è in KB su Linux, in byte su macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+    return round(own, 1), round(children, 1)
+
+
+def run_one(config: dict) -> dict:
+    """Esegue una configurazione (nel processo figlio) e ritorna le metriche"""
+    normalizer = MusicNormalizer(target_lufs=config['target'])
+    normalizer.mode = config['mode']
+    normalizer.analysis_engine = config['analysis_engine']
+    normalizer.output_codec = config['codec']
+    normalizer.decode_once = config['decode_once']
+    normalizer.pcm_budget = PcmBudget(config['pcm_memory'] * 1024 * 1024)
+    available, ffmpeg_path = normalizer.check_ffmpeg()
+    if not available:
+        raise RuntimeError('ffmpeg non disponibile')
+
+    work_dir = Path(tempfile.mkdtemp(prefix='bench-'))
+    try:
+        engine = BatchEngine(
+            normalizer, ffmpeg_path, Path(config['input']), work_dir / 'out',
+            max_workers=config['workers'],
+            # Indice nuovo a ogni esecuzione: il costo di ffprobe è incluso
+            index_path=work_dir / '.library_index.db',
+        )
+        start = time.perf_counter()
+        summary = engine.run()
+        wall = time.perf_counter() - start
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    own_rss, child_rss = peak_rss_mb()
+    processed = summary['success'] + summary['failed']
+    return {
+        'workers': config['workers'],
+        'files': processed,
+        'failed': summary['failed'],
+        'audio_seconds': round(summary['total_duration'], 2),
+        'wall_seconds': round(wall, 3),
+        'files_per_sec': round(processed / wall, 3) if wall else None,
+        'audio_sec_per_wall_sec': round(summary['total_duration'] / wall, 2) if wall else None,
+        # Secondi-worker per fase (somma sui worker paralleli) e attesa in coda
+        'stage_seconds': {k: v['wall'] for k, v in sorted(summary['stages'].items())},
+        'stage_cpu_seconds': {k: v['cpu'] for k, v in sorted(summary['stages'].items())},
+        'queue_wait_seconds': summary['queue_wait'],
+        'peak_rss_mb': own_rss,
+        'peak_child_rss_mb': child_rss,
+    }
+
+
+# Avvio della GUI fino a quando la verifica di ffmpeg (in un thread) aggiorna la finestra
+GUI_STARTUP = """
+import sys
+sys.path.insert(0, {script_dir!r})
+import normalize_music
+normalize_music.import_tkinter()
+try:
+    root = normalize_music.tk.Tk()
+except normalize_music.tk.TclError:
+    sys.exit(3)  # nessun display
+app = normalize_music.NormalizerGUI(root)
+
+def ready():
+    if app.ffmpeg_status.cget('text').startswith('⏳'):
+        root.after(5, ready)
+    else:
+        root.destroy()
+
+root.after(0, ready)
+root.mainloop()
+"""
+
+
+def startup_benchmark(workdir: Path, repeat: int) -> dict:
+    """Mediana dei tempi di avvio (s) per punto di ingresso, con cache di ffmpeg vuota e pronta"""
+    cache_dir = workdir / 'startup-cache'
+    empty_dir = workdir / 'startup-empty'
+    empty_dir.mkdir(parents=True, exist_ok=True)
+    # La cache dei probe segue LOCALAPPDATA (Windows) o XDG_CACHE_HOME
+    env = dict(os.environ, LOCALAPPDATA=str(cache_dir.resolve()), XDG_CACHE_HOME=str(cache_dir.resolve()))
+    tool_cache = cache_dir / 'music-normalizer' / 'tools.json'
+    commands = {
+        'import': [sys.executable, '-c', f'import sys; sys.path.insert(0, {str(SCRIPT_DIR)!r}); '
+                                         'import normalize_music'],
+        'headless': [sys.executable, str(SCRIPT_DIR / 'normalize_music.py'), '-i', str(empty_dir),
+                     '-o', str(workdir / 'startup-out'), '--no-cache', '-q'],
+        'gui': [sys.executable, '-c', GUI_STARTUP.format(script_dir=str(SCRIPT_DIR))],
+    }
+    results = {}
+    for name, cmd in commands.items():
+        timings = {}
+        for state in ('cold', 'warm'):
+            samples = []
+            for _ in range(repeat):
+                if state == 'cold' and tool_cache.exists():
+                    tool_cache.unlink()
+                start = time.perf_counter()
+                result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+                elapsed = time.perf_counter() - start
+                if result.returncode != 0:
+                    break
+                samples.append(elapsed)
+            if not samples:
+                reason = 'nessun display' if result.returncode == 3 else f'uscita {result.returncode}'
+                print(f"  {name:>8}: saltato ({reason})", file=sys.stderr)
+                timings = None
+                break
+            timings[state] = round(statistics.median(samples), 3)
+        if timings is not None:
+            print(f"  {name:>8}: {timings['cold']:.3f}s a freddo, {timings['warm']:.3f}s con cache",
+                  file=sys.stderr)
+        results[name] = timings
+    return results
+
+
+def compare_startup(results: dict, baseline_path: Path, threshold: float) -> List[str]:
+    """Confronta i tempi di avvio con un risultato precedente; ritorna le regressioni"""
+    baseline = json.loads(baseline_path.read_text()).get('startup') or {}
+    regressions = []
+    print(f"\nConfronto con {baseline_path.name}:", file=sys.stderr)
+    for name, timings in results['startup'].items():
+        old = baseline.get(name)
+        if not timings or not old:
+            continue
+        for state, seconds in timings.items():
+            if not old.get(state):
+                continue
+            change = (seconds - old[state]) / old[state] * 100
+            flag = ''
+            if change > threshold:
+                flag = '  ⚠️  REGRESSIONE'
+                regressions.append(f"{name} ({state}): {change:+.1f}%")
+            print(f"  {name:>8} {state}: {old[state]:.3f}s → {seconds:.3f}s ({change:+.1f}%){flag}",
+                  file=sys.stderr)
+    return regressions
+
+
+def ebur128_lra(ffmpeg_path: str, file_path: Path) -> Optional[float]:
+    """Loudness range di riferimento (filtro ebur128 di ffmpeg, EBU Tech 3342)"""
+    result = subprocess.run([ffmpeg_path, '-hide_banner', '-nostats', '-i', str(file_path),
+                             '-map', '0:a:0', '-af', 'ebur128', '-f', 'null', '-'],
+                            capture_output=True, text=True, errors='replace')
+    values = [line.split()[1] for line in result.stderr.splitlines()
+              if line.strip().startswith('LRA:')]
+    return float(values[-1]) if values else None
+
+
+def check_engines(ffmpeg_path: str, fixtures: List[Path]) -> List[str]:
+    """Misura ogni fixture con i due motori; ritorna gli scarti oltre ENGINE_TOLERANCES"""
+    engines = {}
+    for engine in ('loudnorm', 'numpy'):
+        engines[engine] = MusicNormalizer()
+        engines[engine].analysis_engine = engine
+        engines[engine].check_ffmpeg()
+
+    failures = []
+    print(f"  {'file':<24} {'ΔI':>6} {'ΔTP':>6} {'ΔLRA':>6}  (LRA loudnorm / ebur128 / numpy)",
+          file=sys.stderr)
+    for file in fixtures:
+        reference = engines['loudnorm'].analyze_loudness(file, ffmpeg_path)
+        measured = engines['numpy'].analyze_loudness(file, ffmpeg_path)
+        lra = ebur128_lra(ffmpeg_path, file)
+        if reference is None or measured is None or lra is None:
+            failures.append(f"{file.name}: misura non riuscita")
+            continue
+        deltas = {
+            'input_i': measured.input_i - reference.input_i,
+            'input_tp': measured.input_tp - reference.input_tp,
+            'input_lra': measured.input_lra - lra,
+        }
+        flag = ''
+        for field, delta in deltas.items():
+            if abs(delta) > ENGINE_TOLERANCES[field]:
+                failures.append(f"{file.name}: {field} {delta:+.2f} (max ±{ENGINE_TOLERANCES[field]})")
+                flag = '  ⚠️  FUORI TOLLERANZA'
+        print(f"  {file.name:<24} {deltas['input_i']:+6.2f} {deltas['input_tp']:+6.2f} "
+              f"{deltas['input_lra']:+6.2f}  ({reference.input_lra:.1f} / {lra:.1f} / "
+              f"{measured.input_lra:.1f}){flag}", file=sys.stderr)
+    return failures
+
+
+def compare(results: dict, baseline_path: Path, threshold: float) -> List[str]:
+    """Confronta il throughput con un risultato precedente; ritorna le regressioni"""
+    baseline = json.loads(baseline_path.read_text())
+    previous = {entry['workers']: entry for entry in baseline['summary']}
+    regressions = []
+    print(f"\nConfronto con {baseline_path.name}:", file=sys.stderr)
+    for entry in results['summary']:
+        old = previous.get(entry['workers'])
+        if old is None or not old['files_per_sec']:
+            continue
+        change = (entry['files_per_sec'] - old['files_per_sec']) / old['files_per_sec'] * 100
+        flag = ''
+        if change < -threshold:
+            flag = '  ⚠️  REGRESSIONE'
+            regressions.append(f"{entry['workers']} worker: {change:+.1f}%")
+        print(f"  {entry['workers']:>3} worker: {old['files_per_sec']:.3f} → "
+              f"{entry['files_per_sec']:.3f} file/s ({change:+.1f}%){flag}", file=sys.stderr)
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Benchmark di normalize_music su fixture sintetiche')
+    parser.add_argument('-j', '--workers', type=int, action='append',
+                        help='numero di worker da provare (ripetibile, default: 1, 2, CPU)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='esecuzioni per configurazione (si riporta la mediana)')
+    parser.add_argument('--copies', type=int, default=2,
+                        help='copie di ogni fixture, con livelli diversi (default: 2)')
+    parser.add_argument('--short', type=float, default=10.0,
+                        help='durata delle tracce brevi in secondi (default: 10)')
+    parser.add_argument('--long', type=float, default=180.0,
+                        help='durata delle tracce lunghe in secondi (default: 180)')
+    parser.add_argument('--workdir', type=Path, default=Path('.benchmark'),
+                        help='cartella per fixture e risultati (default: .benchmark)')
+    parser.add_argument('-o', '--output', type=Path, default=None,
+                        help='file JSON dei risultati (default: <workdir>/results-<data>.json)')
+    parser.add_argument('--compare', type=Path, default=None,
+                        help='risultato precedente da confrontare')
+    parser.add_argument('--threshold', type=float, default=10.0,
+                        help='calo percentuale di file/s (o aumento del tempo di avvio) '
+                             'considerato regressione (default: 10)')
+    parser.add_argument('-m', '--mode', choices=('loudnorm', 'gain', 'tags'), default='loudnorm')
+    parser.add_argument('--analysis-engine', choices=('loudnorm', 'numpy'), default='loudnorm')
+    parser.add_argument('-c', '--codec', choices=sorted(MusicNormalizer.OUTPUT_CODECS), default=None)
+    parser.add_argument('--decode-once', action='store_true')
+    parser.add_argument('--pcm-memory', type=int, default=512, metavar='MB')
+    parser.add_argument('--startup', action='store_true',
+                        help='misura solo i tempi di avvio (import, CLI headless, GUI)')
+    parser.add_argument('--check-engines', action='store_true',
+                        help='confronta le misure del motore numpy con loudnorm/ebur128 sulle fixture')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.run_one:
+        # Processo figlio: una sola configurazione, risultato JSON su stdout
+        print(json.dumps(run_one(json.loads(args.run_one))))
+        return 0
+
+    normalizer = MusicNormalizer()
+    available, ffmpeg_path = normalizer.check_ffmpeg()
+    if not available:
+        print("✗ ffmpeg non disponibile!", file=sys.stderr)
+        return normalize_music.EXIT_ERROR
+
+    if args.startup:
+        print("⏱️  Tempi di avvio (mediana):", file=sys.stderr)
+        results = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'ffmpeg': normalizer.ffmpeg_version,
+            },
+            'options': {'repeat': args.repeat},
+            'startup': startup_benchmark(args.workdir, args.repeat),
+        }
+        output = args.output or args.workdir / f"startup-{time.strftime('%Y%m%d-%H%M%S')}.json"
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(results, indent=2))
+        print(f"\n✓ Risultati salvati in {output}", file=sys.stderr)
+        if args.compare is not None and compare_startup(results, args.compare, args.threshold):
+            return normalize_music.EXIT_FAILURES
+        return normalize_music.EXIT_OK
+
+    fixture_dir = args.workdir / 'fixtures'
+    print(f"⚙️  Generazione fixture in {fixture_dir}...", file=sys.stderr)
+    fixtures = generate_fixtures(ffmpeg_path, fixture_dir, args.copies, args.short, args.long)
+
+    if args.check_engines:
+        engine_dir = args.workdir / 'engine-fixtures'
+        engine_dir.mkdir(parents=True, exist_ok=True)
+        for name, source, codec_args in ENGINE_FIXTURES:
+            if not (engine_dir / name).exists():
+                subprocess.run([ffmpeg_path, '-v', 'error', '-f', 'lavfi', '-i', source,
+                                *codec_args, '-y', str(engine_dir / name)], check=True)
+        print("📏 Confronto dei motori di analisi (numpy − riferimento):", file=sys.stderr)
+        failures = check_engines(ffmpeg_path, fixtures + [engine_dir / name
+                                                          for name, *_ in ENGINE_FIXTURES])
+        if failures:
+            print("\n✗ Fuori tolleranza:\n  " + "\n  ".join(failures), file=sys.stderr)
+            return normalize_music.EXIT_FAILURES
+        print("\n✓ Motori entro le tolleranze", file=sys.stderr)
+        return normalize_music.EXIT_OK
+
+    cpu_count = os.cpu_count() or 1
+    worker_counts = args.workers or sorted({1, 2, cpu_count})
+    runs = []
+    summary = []
+    for workers in worker_counts:
+        config = {
+            'input': str(fixture_dir.resolve()), 'workers': workers, 'target': -16.0,
+            'mode': args.mode, 'analysis_engine': args.analysis_engine, 'codec': args.codec,
+            'decode_once': args.decode_once, 'pcm_memory': args.pcm_memory,
+        }
+        samples = []
+        for attempt in range(args.repeat):
+            result = subprocess.run(
+                [sys.executable, str(SCRIPT_DIR / 'benchmark.py'), '--run-one', json.dumps(config)],
+                capture_output=True, text=True, check=True
+            )
+            sample = json.loads(result.stdout.strip().splitlines()[-1])
+            sample['attempt'] = attempt
+            samples.append(sample)
+            print(f"  {workers:>3} worker: {sample['files_per_sec']:.3f} file/s, "
+                  f"{sample['audio_sec_per_wall_sec']:.1f}x tempo reale, "
+                  f"{sample['wall_seconds']:.2f}s, RSS {sample['peak_rss_mb']} MB "
+                  f"(ffmpeg {sample['peak_child_rss_mb']} MB)", file=sys.stderr)
+        runs.extend(samples)
+        median = statistics.median(s['files_per_sec'] for s in samples)
+        summary.append({
+            'workers': workers,
+            'files_per_sec': median,
+            'audio_sec_per_wall_sec': statistics.median(s['audio_sec_per_wall_sec'] for s in samples),
+            'wall_seconds': statistics.median(s['wall_seconds'] for s in samples),
+        })
+
+    results = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': cpu_count,
+            'ffmpeg': normalizer.ffmpeg_version,
+        },
+        'options': {
+            'mode': args.mode, 'analysis_engine': args.analysis_engine, 'codec': args.codec,
+            'decode_once': args.decode_once, 'repeat': args.repeat,
+        },
+        'fixtures': {
+            'copies': args.copies, 'short': args.short, 'long': args.long,
+            'files': [p.name for p in fixtures],
+        },
+        'runs': runs,
+        'summary': summary,
+    }
+    output = args.output or args.workdir / f"results-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\n✓ Risultati salvati in {output}", file=sys.stderr)
+
+    if args.compare is not None:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            return normalize_music.EXIT_FAILURES
+    return normalize_music.EXIT_OK
+
+
+if __name__ == '__main__':
+    sys.exit(main())
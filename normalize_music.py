@@ -1,18 +1,1034 @@
 import os
 import sys
 import subprocess
-import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
 from pathlib import Path
-from typing import List, Tuple
+from typing import List, Optional, Tuple
+from dataclasses import dataclass, asdict
 import threading
 import queue
 import concurrent.futures
+import collections
+import fnmatch
+import heapq
+import itertools
+import math
+import re
+import signal
 import json
+import time
+
+
+@dataclass
+class LoudnessStats:
+    """Misure loudnorm di un file (una sola analisi per file)"""
+    input_i: float
+    input_tp: float
+    input_lra: float
+    input_thresh: float
+    target_offset: float
+    # Istogramma dei blocchi di gating da 400 ms sopra -70 LUFS: coppie
+    # [loudness in decimi di LU, numero di blocchi] (solo in modalità album)
+    blocks: Optional[List[List[int]]] = None
+    # Durata effettivamente decodificata dall'analisi (secondi): quella del
+    # contenitore può essere solo stimata dal bitrate (MP3 VBR senza Xing)
+    duration: Optional[float] = None
+
+
+class R128Analyzer:
+    """Misura EBU R128 (ITU-R BS.1770-4) in streaming su PCM float con NumPy
+    
+    Integrated loudness con gating, LRA (EBU Tech 3342) e true peak con
+    oversampling 4x. La memoria resta limitata: si conserva solo la potenza
+    di ogni sotto-blocco da 100 ms.
+    """
+    SAMPLE_RATE = 48000
+    CHUNK = 65536  # campioni per canale letti dalla pipe
+    # Prototipi analogici del K-weighting (BS.1770): shelving e passa-alto RLB,
+    # discretizzati per il sample rate effettivo (a 48 kHz danno i coefficienti ITU)
+    PRE_FILTER = {'f0': 1681.974450955533, 'gain_db': 3.999843853973347, 'q': 0.7071752369554196}
+    RLB_FILTER = {'f0': 38.13547087602444, 'q': 0.5003270373238773}
+    OVERSAMPLE = 4
+    TP_TAPS = 48  # coefficienti per fase del filtro di interpolazione
+    _kernels = {}
+    _tp_phases = None
+    
+    def __init__(self, channels: int, sample_rate: int = SAMPLE_RATE):
+        import numpy as np
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.subblock = sample_rate // 10  # 100 ms
+        # Pesi dei canali (BS.1770): LFE escluso, surround +1.5 dB (layout 5.1 ffmpeg)
+        if channels == 6:
+            self.weights = np.array([1.0, 1.0, 1.0, 0.0, 1.41, 1.41])
+        else:
+            self.weights = np.ones(channels)
+        # La risposta all'impulso del K-weighting decade sotto 1e-30 entro ~1/3 s:
+        # il filtro IIR si applica come FIR via FFT (overlap-add), vettorizzato
+        kernel = self.k_weighting_kernel(sample_rate)
+        self.ir_length = len(kernel)
+        self.fft_size = 1 << (self.CHUNK + self.ir_length - 1).bit_length()
+        self.spectrum = np.fft.rfft(kernel, self.fft_size)
+        self.tail = np.zeros((self.ir_length - 1, channels))
+        self.pending = np.zeros((0, channels))
+        self.tp_history = np.zeros((self.TP_TAPS - 1, channels))
+        self.subblocks = []
+        self.peak = 0.0
+    
+    @classmethod
+    def k_weighting_coefficients(cls, sample_rate: int):
+        """Coefficienti (b, a) dei due biquad K-weighting per il sample rate dato"""
+        pre, rlb = cls.PRE_FILTER, cls.RLB_FILTER
+        k = math.tan(math.pi * pre['f0'] / sample_rate)
+        vh = 10 ** (pre['gain_db'] / 20)
+        vb = vh ** 0.4996667741545416
+        a0 = 1 + k / pre['q'] + k * k
+        shelving = ((vh + vb * k / pre['q'] + k * k) / a0, 2 * (k * k - vh) / a0,
+                    (vh - vb * k / pre['q'] + k * k) / a0)
+        shelving_a = (1.0, 2 * (k * k - 1) / a0, (1 - k / pre['q'] + k * k) / a0)
+        
+        k = math.tan(math.pi * rlb['f0'] / sample_rate)
+        a0 = 1 + k / rlb['q'] + k * k
+        highpass = (1.0, -2.0, 1.0)
+        highpass_a = (1.0, 2 * (k * k - 1) / a0, (1 - k / rlb['q'] + k * k) / a0)
+        return (shelving, shelving_a), (highpass, highpass_a)
+    
+    @classmethod
+    def k_weighting_kernel(cls, sample_rate: int):
+        """Risposta all'impulso dei due biquad K-weighting in cascata"""
+        if sample_rate not in cls._kernels:
+            import numpy as np
+            length = 1 << (sample_rate // 3).bit_length()
+            x = [0.0] * length
+            x[0] = 1.0
+            for (b0, b1, b2), (_, a1, a2) in cls.k_weighting_coefficients(sample_rate):
+                y = [0.0] * length
+                x1 = x2 = y1 = y2 = 0.0
+                for n, xn in enumerate(x):
+                    yn = b0 * xn + b1 * x1 + b2 * x2 - a1 * y1 - a2 * y2
+                    y[n] = yn
+                    x2, x1, y2, y1 = x1, xn, y1, yn
+                x = y
+            cls._kernels[sample_rate] = np.array(x)
+        return cls._kernels[sample_rate]
+    
+    @classmethod
+    def true_peak_phases(cls):
+        """Fasi del filtro di interpolazione 4x (sinc con finestra di Kaiser)"""
+        if cls._tp_phases is None:
+            import numpy as np
+            length = cls.TP_TAPS * cls.OVERSAMPLE
+            n = np.arange(length) - (length - 1) / 2
+            h = np.sinc(n / cls.OVERSAMPLE) * np.kaiser(length, 8.0)
+            h *= cls.OVERSAMPLE / h.sum()
+            cls._tp_phases = [h[k::cls.OVERSAMPLE] for k in range(cls.OVERSAMPLE)]
+        return cls._tp_phases
+    
+    def process(self, frames):
+        """Aggiunge un blocco di campioni (array frames × canali)"""
+        import numpy as np
+        x = np.asarray(frames, dtype=np.float64)
+        if len(x) == 0:
+            return
+        
+        # True peak: interpolazione polifase con la coda del blocco precedente
+        extended = np.concatenate([self.tp_history, x])
+        for ch in range(self.channels):
+            for phase in self.true_peak_phases():
+                upsampled = np.convolve(extended[:, ch], phase, mode='valid')
+                self.peak = max(self.peak, float(np.max(np.abs(upsampled))))
+        self.peak = max(self.peak, float(np.max(np.abs(x))))
+        self.tp_history = extended[-(self.TP_TAPS - 1):]
+        
+        # K-weighting (overlap-add via FFT)
+        for start in range(0, len(x), self.CHUNK):
+            block = x[start:start + self.CHUNK]
+            y = np.fft.irfft(np.fft.rfft(block, self.fft_size, axis=0)
+                             * self.spectrum[:, None], self.fft_size, axis=0)
+            y = y[:len(block) + self.ir_length - 1]
+            y[:self.ir_length - 1] += self.tail
+            self.tail = y[len(block):]
+            self.accumulate(y[:len(block)])
+    
+    def accumulate(self, filtered):
+        """Potenza pesata per canale dei sotto-blocchi da 100 ms completi"""
+        import numpy as np
+        data = np.concatenate([self.pending, filtered])
+        count = len(data) // self.subblock
+        if count:
+            blocks = data[:count * self.subblock].reshape(count, self.subblock, self.channels)
+            self.subblocks.append(np.mean(blocks ** 2, axis=1) @ self.weights)
+        self.pending = data[count * self.subblock:]
+    
+    @staticmethod
+    def loudness(power):
+        import numpy as np
+        with np.errstate(divide='ignore'):
+            return -0.691 + 10 * np.log10(power)
+    
+    def gated_blocks(self, subblocks, length: int, relative_gate: float):
+        """Blocchi di `length` sotto-blocchi (passo 100 ms) oltre i gate assoluto e relativo"""
+        import numpy as np
+        if len(subblocks) < length:
+            return np.zeros(0), None
+        cumulative = np.concatenate([[0.0], np.cumsum(subblocks)])
+        power = (cumulative[length:] - cumulative[:-length]) / length
+        power = power[self.loudness(power) > -70.0]
+        if len(power) == 0:
+            return power, None
+        threshold = float(self.loudness(np.mean(power))) + relative_gate
+        return power[self.loudness(power) > threshold], threshold
+    
+    @staticmethod
+    def block_histogram(levels) -> List[List[int]]:
+        """Istogramma (passo 0.1 LU) dei livelli dei blocchi oltre il gate assoluto"""
+        counts = collections.Counter(round(level * 10) for level in levels if level > -70.0)
+        return [[level, count] for level, count in sorted(counts.items())]
+    
+    @classmethod
+    def histogram_loudness(cls, histogram) -> Optional[float]:
+        """Integrated loudness (gate relativo -10 LU) da uno o più istogrammi sommati
+        
+        Python puro: serve anche con il motore loudnorm, senza NumPy.
+        """
+        def mean_loudness(blocks):
+            total = sum(count for _, count in blocks)
+            if not total:
+                return None
+            power = sum(10 ** ((level + 0.691) / 10) * count for level, count in blocks)
+            return -0.691 + 10 * math.log10(power / total)
+        
+        blocks = [(level / 10, count) for level, count in histogram]
+        ungated = mean_loudness(blocks)
+        if ungated is None:
+            return None
+        return mean_loudness([(level, count) for level, count in blocks if level > ungated - 10])
+    
+    def result(self, blocks: bool = False) -> Optional[LoudnessStats]:
+        """Statistiche finali nello stesso formato di loudnorm (+ istogramma se `blocks`)"""
+        import numpy as np
+        if not self.subblocks:
+            return None
+        subblocks = np.concatenate(self.subblocks)
+        
+        # Integrated: blocchi da 400 ms, gate -70 LUFS e relativo -10 LU
+        gated, threshold = self.gated_blocks(subblocks, 4, -10.0)
+        if threshold is None or len(gated) == 0:
+            return None
+        integrated = float(self.loudness(np.mean(gated)))
+        
+        # LRA: blocchi da 3 s, gate relativo -20 LU, percentili 10-95
+        short_term, _ = self.gated_blocks(subblocks, 30, -20.0)
+        lra = 0.0
+        if len(short_term):
+            levels = self.loudness(short_term)
+            lra = float(np.percentile(levels, 95) - np.percentile(levels, 10))
+        
+        with np.errstate(divide='ignore'):
+            true_peak = float(20 * np.log10(self.peak)) if self.peak > 0 else float('-inf')
+        return LoudnessStats(
+            input_i=round(integrated, 2),
+            input_tp=round(true_peak, 2),
+            input_lra=round(lra, 2),
+            input_thresh=round(threshold, 2),
+            target_offset=0.0,
+            blocks=self.block_histogram(self.loudness(
+                np.convolve(subblocks, np.full(4, 0.25), mode='valid')).tolist()) if blocks else None,
+        )
+
+
+class MeasurementCache:
+    """Cache su disco delle misure loudness (SQLite), chiave path + size + mtime"""
+    
+    def __init__(self, db_path: Path, ffmpeg_version: str = '',
+                 max_entries: int = 200000, max_age_days: float = 180,
+                 use_content_hash: bool = False):
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.max_age_days = max_age_days
+        self.use_content_hash = use_content_hash
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        
+        import sqlite3
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS measurements ('
+            ' path TEXT NOT NULL, params TEXT NOT NULL,'
+            ' size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+            ' content_hash TEXT, stats TEXT NOT NULL,'
+            ' created REAL NOT NULL, last_used REAL NOT NULL,'
+            ' PRIMARY KEY (path, params))'
+        )
+        self.conn.execute(
+            'CREATE INDEX IF NOT EXISTS idx_measurements_hash '
+            'ON measurements (content_hash, params)'
+        )
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        
+        # Misure fatte con un'altra versione di ffmpeg non sono affidabili
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'ffmpeg_version'").fetchone()
+        if ffmpeg_version and (row is None or row[0] != ffmpeg_version):
+            self.invalidate()
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('ffmpeg_version', ?)",
+                              (ffmpeg_version,))
+        self.conn.commit()
+    
+    @staticmethod
+    def content_hash(file_path: Path) -> str:
+        """Hash del contenuto del file (BLAKE2b)"""
+        import hashlib
+        digest = hashlib.blake2b(digest_size=20)
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def get(self, file_path: Path, params: str) -> Optional[LoudnessStats]:
+        """Ritorna le misure in cache se il file non è cambiato"""
+        st = file_path.stat()
+        key = str(file_path.resolve())
+        now = time.time()
+        
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT size, mtime_ns, content_hash, stats FROM measurements '
+                'WHERE path = ? AND params = ?', (key, params)
+            ).fetchone()
+        
+        stats_json = None
+        if row is not None and row[0] == st.st_size and row[1] == st.st_mtime_ns:
+            stats_json = row[3]
+        elif self.use_content_hash:
+            # mtime cambiato o file spostato: confronta il contenuto
+            digest = self.content_hash(file_path)
+            with self.lock:
+                match = self.conn.execute(
+                    'SELECT stats FROM measurements WHERE content_hash = ? AND params = ? '
+                    'AND size = ?', (digest, params, st.st_size)
+                ).fetchone()
+            if match is not None:
+                stats_json = match[0]
+                self.put(file_path, params, LoudnessStats(**json.loads(stats_json)), digest)
+        
+        with self.lock:
+            if stats_json is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.conn.execute('UPDATE measurements SET last_used = ? WHERE path = ? AND params = ?',
+                              (now, key, params))
+            self.conn.commit()
+        return LoudnessStats(**json.loads(stats_json))
+    
+    def put(self, file_path: Path, params: str, stats: LoudnessStats,
+            digest: Optional[str] = None):
+        """Salva le misure di un file"""
+        st = file_path.stat()
+        if digest is None and self.use_content_hash:
+            digest = self.content_hash(file_path)
+        now = time.time()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (str(file_path.resolve()), params, st.st_size, st.st_mtime_ns,
+                 digest, json.dumps(asdict(stats)), now, now)
+            )
+            self.conn.commit()
+    
+    def invalidate(self):
+        """Svuota la cache"""
+        with self.lock:
+            self.conn.execute('DELETE FROM measurements')
+            self.conn.commit()
+    
+    def evict(self):
+        """Rimuove le voci troppo vecchie e quelle oltre il limite di dimensione"""
+        cutoff = time.time() - self.max_age_days * 86400
+        with self.lock:
+            self.conn.execute('DELETE FROM measurements WHERE last_used < ?', (cutoff,))
+            self.conn.execute(
+                'DELETE FROM measurements WHERE rowid IN ('
+                ' SELECT rowid FROM measurements ORDER BY last_used DESC LIMIT -1 OFFSET ?)',
+                (self.max_entries,)
+            )
+            self.conn.commit()
+    
+    def close(self):
+        """Applica l'eviction e chiude il database"""
+        self.evict()
+        with self.lock:
+            self.conn.close()
+
+
+class JobManifest:
+    """Manifest dei job (SQLite): stato di ogni input per le esecuzioni incrementali"""
+    
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        import sqlite3
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' input TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+            ' params TEXT NOT NULL, output TEXT, status TEXT NOT NULL, updated REAL NOT NULL)'
+        )
+        self.conn.commit()
+    
+    def is_done(self, input_path: Path, params: str) -> bool:
+        """True se l'input è già stato normalizzato con gli stessi parametri e non è cambiato"""
+        st = input_path.stat()
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT size, mtime_ns, params, output, status FROM jobs WHERE input = ?',
+                (str(input_path.resolve()),)
+            ).fetchone()
+        if row is None:
+            return False
+        size, mtime_ns, done_params, output, status = row
+        return (status == 'done' and size == st.st_size and mtime_ns == st.st_mtime_ns
+                and done_params == params and output is not None and Path(output).exists())
+    
+    def mark(self, input_path: Path, params: str, status: str,
+             output_path: Optional[Path] = None):
+        """Registra lo stato di un job ('running', 'done', 'failed')"""
+        st = input_path.stat()
+        with self.lock:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (str(input_path.resolve()), st.st_size, st.st_mtime_ns, params,
+                 str(output_path) if output_path is not None else None, status, time.time())
+            )
+            self.conn.commit()
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class WorkQueue:
+    """Coda di job condivisa tra più macchine (SQLite su storage condiviso)
+    
+    Il coordinatore inserisce i file (percorsi relativi alla cartella di input)
+    e i parametri del batch; i worker prendono un job alla volta in lease,
+    rinnovato da un heartbeat. Un lease scaduto (worker caduto) torna
+    disponibile agli altri worker fino a MAX_ATTEMPTS tentativi.
+    """
+    LEASE_SECONDS = 120
+    MAX_ATTEMPTS = 3
+    
+    def __init__(self, db_path: Path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        # Niente WAL: richiede memoria condivisa e non funziona su NFS/SMB.
+        # Le transazioni esplicite (BEGIN IMMEDIATE) serializzano i claim
+        import sqlite3
+        self.conn = sqlite3.connect(str(db_path), timeout=60, isolation_level=None,
+                                    check_same_thread=False)
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS jobs ('
+            ' path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+            ' cost REAL NOT NULL, status TEXT NOT NULL, attempts INTEGER NOT NULL,'
+            ' worker TEXT, lease_until REAL, report TEXT, updated REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, cost)')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS workers ('
+            ' worker TEXT PRIMARY KEY, last_seen REAL NOT NULL, completed INTEGER NOT NULL)'
+        )
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+    
+    def transaction(self, sql: str, params=(), many: bool = False) -> int:
+        """Esegue una scrittura in una transazione IMMEDIATE (righe modificate)"""
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                cursor = (self.conn.executemany if many else self.conn.execute)(sql, params)
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+            return cursor.rowcount
+    
+    def configure(self, settings: dict):
+        """Salva i parametri del batch; se cambiano, tutti i job tornano da elaborare"""
+        value = json.dumps(settings, sort_keys=True)
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+        if row is not None and row[0] == value:
+            return
+        self.transaction("INSERT OR REPLACE INTO meta VALUES ('settings', ?)", (value,))
+        self.transaction("UPDATE jobs SET status = 'pending', attempts = 0, worker = NULL,"
+                         " lease_until = NULL, report = NULL WHERE status != 'leased'")
+    
+    def settings(self) -> Optional[dict]:
+        """Parametri del batch scritti dal coordinatore (None = coda non inizializzata)"""
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'settings'").fetchone()
+        return json.loads(row[0]) if row is not None else None
+    
+    def add(self, entries: List[Tuple[str, int, int, float]], reset: bool = False):
+        """Accoda (percorso, size, mtime_ns, costo); i job completati restano tali
+        se il file non è cambiato, a meno di `reset`"""
+        now = time.time()
+        self.transaction(
+            "INSERT INTO jobs VALUES (?, ?, ?, ?, 'pending', 0, NULL, NULL, NULL, ?) "
+            "ON CONFLICT (path) DO UPDATE SET size = excluded.size,"
+            " mtime_ns = excluded.mtime_ns, cost = excluded.cost, status = 'pending',"
+            " attempts = 0, worker = NULL, lease_until = NULL, report = NULL,"
+            " updated = excluded.updated "
+            "WHERE jobs.status != 'leased' AND (? OR jobs.status = 'failed'"
+            " OR jobs.size != excluded.size OR jobs.mtime_ns != excluded.mtime_ns)",
+            [(path, size, mtime_ns, cost, now, reset) for path, size, mtime_ns, cost in entries],
+            many=True
+        )
+    
+    def claim(self, worker: str) -> Optional[str]:
+        """Prende in lease il job più costoso disponibile (nuovo o con lease scaduto)"""
+        now = time.time()
+        with self.lock:
+            self.conn.execute('BEGIN IMMEDIATE')
+            try:
+                # Troppi lease scaduti: il file probabilmente blocca i worker
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'failed', worker = NULL, report = ? "
+                    "WHERE status = 'leased' AND lease_until < ? AND attempts >= ?",
+                    (json.dumps({'error': f'lease scaduto ({self.MAX_ATTEMPTS} tentativi)'}),
+                     now, self.MAX_ATTEMPTS)
+                )
+                row = self.conn.execute(
+                    "SELECT path FROM jobs WHERE status = 'pending'"
+                    " OR (status = 'leased' AND lease_until < ?) "
+                    "ORDER BY cost DESC LIMIT 1", (now,)
+                ).fetchone()
+                if row is not None:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'leased', attempts = attempts + 1, worker = ?,"
+                        " lease_until = ?, updated = ? WHERE path = ?",
+                        (worker, now + self.LEASE_SECONDS, now, row[0])
+                    )
+                self.conn.execute('COMMIT')
+            except BaseException:
+                self.conn.execute('ROLLBACK')
+                raise
+        return row[0] if row is not None else None
+    
+    def heartbeat(self, worker: str, completed: int = 0):
+        """Rinnova i lease del worker e ne registra l'attività"""
+        now = time.time()
+        self.transaction("UPDATE jobs SET lease_until = ? WHERE status = 'leased' AND worker = ?",
+                         (now + self.LEASE_SECONDS, worker))
+        self.transaction('INSERT OR REPLACE INTO workers VALUES (?, ?, ?)',
+                         (worker, now, completed))
+    
+    def complete(self, path: str, worker: str, report: dict) -> bool:
+        """Registra il risultato; False se il lease era passato a un altro worker"""
+        status = 'done' if report['status'] == 'done' else 'failed'
+        return self.transaction(
+            "UPDATE jobs SET status = ?, worker = ?, lease_until = NULL, report = ?, updated = ? "
+            "WHERE path = ? AND status = 'leased' AND worker = ?",
+            (status, worker, json.dumps(report, ensure_ascii=False), time.time(), path, worker)
+        ) > 0
+    
+    def release(self, path: str, worker: str):
+        """Restituisce un job annullato alla coda (il tentativo non conta)"""
+        self.transaction(
+            "UPDATE jobs SET status = 'pending', attempts = attempts - 1, worker = NULL,"
+            " lease_until = NULL WHERE path = ? AND status = 'leased' AND worker = ?",
+            (path, worker)
+        )
+    
+    def progress(self) -> dict:
+        """Numero di job per stato e worker attivi (heartbeat entro un lease)"""
+        with self.lock:
+            counts = dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status'))
+            workers = self.conn.execute('SELECT COUNT(*) FROM workers WHERE last_seen > ?',
+                                        (time.time() - self.LEASE_SECONDS,)).fetchone()[0]
+        progress = {status: counts.get(status, 0) for status in ('pending', 'leased', 'done', 'failed')}
+        progress['workers'] = workers
+        return progress
+    
+    def results(self) -> List[dict]:
+        """Report dei job terminati (completati o falliti)"""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT path, status, report FROM jobs WHERE status IN ('done', 'failed') "
+                "ORDER BY path"
+            ).fetchall()
+        return [{'input': path, 'output': None, 'action': None,
+                 **(json.loads(report) if report else {}), 'status': status}
+                for path, status, report in rows]
+    
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+class LibraryIndex:
+    """Indice persistente dei metadati ffprobe della libreria (SQLite), chiave path + size + mtime"""
+    
+    # Campi conservati per formato e stream (il resto dell'output ffprobe non serve)
+    FORMAT_FIELDS = ('format_name', 'duration', 'duration_estimated', 'bit_rate', 'size')
+    STREAM_FIELDS = ('index', 'codec_type', 'codec_name', 'sample_rate', 'channels',
+                     'channel_layout', 'bit_rate', 'bits_per_raw_sample', 'duration')
+    # Tag per i gruppi della modalità album (chiavi minuscole senza '_' e spazi)
+    TAG_FIELDS = ('album', 'albumartist')
+    # Versione del formato delle voci: quelle di versioni precedenti vengono scartate
+    SCHEMA = 3
+    
+    def __init__(self, db_path: Path, max_age_days: float = 365):
+        self.db_path = db_path
+        self.max_age_days = max_age_days
+        self.memo = {}
+        self.lock = threading.Lock()
+        import sqlite3
+        self.conn = sqlite3.connect(str(db_path), check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute(
+            'CREATE TABLE IF NOT EXISTS probes ('
+            ' path TEXT PRIMARY KEY, size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL,'
+            ' probe TEXT, updated REAL NOT NULL)'
+        )
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'schema'").fetchone()
+        if row is None or row[0] != str(self.SCHEMA):
+            self.conn.execute('DELETE FROM probes')
+            self.conn.execute("INSERT OR REPLACE INTO meta VALUES ('schema', ?)",
+                              (str(self.SCHEMA),))
+        self.conn.commit()
+    
+    @classmethod
+    def compact(cls, probe: Optional[dict]) -> Optional[dict]:
+        """Riduce l'output di ffprobe ai campi usati da scheduler e profili"""
+        if probe is None:
+            return None
+        def fields(entry: dict, names: Tuple[str, ...]) -> dict:
+            kept = {k: entry[k] for k in names if k in entry}
+            tags = cls.compact_tags(entry.get('tags'))
+            if tags:
+                kept['tags'] = tags
+            return kept
+        
+        return {
+            'format': fields(probe.get('format', {}), cls.FORMAT_FIELDS),
+            'streams': [fields(st, cls.STREAM_FIELDS) for st in probe.get('streams', [])],
+        }
+    
+    @classmethod
+    def compact_tags(cls, tags: Optional[dict]) -> dict:
+        """Tag album con chiavi normalizzate ('ALBUM ARTIST', 'album_artist' -> 'albumartist')"""
+        kept = {}
+        for key, value in (tags or {}).items():
+            name = key.lower().replace('_', '').replace(' ', '')
+            if name in cls.TAG_FIELDS and str(value).strip():
+                kept.setdefault(name, str(value).strip())
+        return kept
+    
+    def lookup(self, file_path: Path) -> Tuple[bool, Optional[dict]]:
+        """(trovato, probe) per un file non modificato (non trovato se sparito)"""
+        try:
+            st = file_path.stat()
+        except OSError:
+            return False, None
+        key = str(file_path.resolve())
+        with self.lock:
+            cached = self.memo.get(key)
+            if cached is not None and cached[0] == (st.st_size, st.st_mtime_ns):
+                return True, cached[1]
+            row = self.conn.execute(
+                'SELECT size, mtime_ns, probe FROM probes WHERE path = ?', (key,)
+            ).fetchone()
+        if row is None or row[0] != st.st_size or row[1] != st.st_mtime_ns:
+            return False, None
+        probe = json.loads(row[2])
+        if probe is None:
+            # Fallimento salvato da versioni precedenti: si riprova ffprobe
+            return False, None
+        with self.lock:
+            self.memo[key] = ((st.st_size, st.st_mtime_ns), probe)
+        return True, probe
+    
+    def put(self, file_path: Path, probe: dict):
+        """Salva i metadati di un file (ignorato se il file è sparito)"""
+        try:
+            st = file_path.stat()
+        except OSError:
+            return
+        key = str(file_path.resolve())
+        probe = self.compact(probe)
+        with self.lock:
+            self.memo[key] = ((st.st_size, st.st_mtime_ns), probe)
+            self.conn.execute(
+                'INSERT OR REPLACE INTO probes VALUES (?, ?, ?, ?, ?)',
+                (key, st.st_size, st.st_mtime_ns, json.dumps(probe), time.time())
+            )
+            self.conn.commit()
+    
+    def close(self):
+        """Rimuove le voci vecchie e chiude il database"""
+        cutoff = time.time() - self.max_age_days * 86400
+        with self.lock:
+            self.conn.execute('DELETE FROM probes WHERE updated < ?', (cutoff,))
+            self.conn.commit()
+            self.conn.close()
+
+
+class PcmBudget:
+    """Memoria condivisa dai buffer PCM dei worker (oltre il limite si usa il disco)"""
+    
+    def __init__(self, limit_bytes: int = 512 * 1024 * 1024):
+        self.limit = limit_bytes
+        self.used = 0
+        self.lock = threading.Lock()
+    
+    def try_reserve(self, size: int) -> bool:
+        """Riserva `size` byte se rientrano nel limite"""
+        with self.lock:
+            if self.used + size > self.limit:
+                return False
+            self.used += size
+            return True
+    
+    def release(self, size: int):
+        with self.lock:
+            self.used = max(0, self.used - size)
+
+
+class PcmBuffer:
+    """Audio decodificato una volta sola (float32 interleaved), in RAM o su file
+    
+    Alimenta sia l'analisi sia la codifica finale, così ogni sorgente viene
+    decodificata un'unica volta.
+    """
+    
+    def __init__(self, sample_rate: int, channels: int, data: Optional[bytes] = None,
+                 path: Optional[Path] = None, budget: Optional[PcmBudget] = None,
+                 reserved: int = 0):
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.data = data
+        self.path = path
+        self.budget = budget
+        self.reserved = reserved
+    
+    @property
+    def size(self) -> int:
+        if self.data is not None:
+            return len(self.data)
+        return self.path.stat().st_size
+    
+    @property
+    def duration(self) -> float:
+        return self.size / (4 * self.channels * self.sample_rate)
+    
+    def input_args(self) -> List[str]:
+        """Argomenti di input ffmpeg per leggere il PCM (stdin o file)"""
+        source = '-' if self.data is not None else str(self.path)
+        return ['-f', 'f32le', '-ar', str(self.sample_rate),
+                '-ac', str(self.channels), '-i', source]
+    
+    def stdin_data(self) -> Optional[bytes]:
+        """Dati da passare su stdin (None se il PCM è su file)"""
+        return self.data
+    
+    def frames(self):
+        """Array NumPy frames × canali (memmap se su disco)"""
+        import numpy as np
+        if self.data is not None:
+            samples = np.frombuffer(self.data, dtype='<f4')
+        else:
+            samples = np.memmap(self.path, dtype='<f4', mode='r')
+        usable = len(samples) - len(samples) % self.channels
+        return samples[:usable].reshape(-1, self.channels)
+    
+    def release(self):
+        """Libera la memoria (o il file temporaneo) del buffer"""
+        self.data = None
+        if self.path is not None:
+            try:
+                self.path.unlink()
+            except OSError:
+                pass
+            self.path = None
+        if self.budget is not None and self.reserved:
+            self.budget.release(self.reserved)
+            self.reserved = 0
+
+
+class JobCancelled(Exception):
+    """Elaborazione annullata dall'utente"""
+
+
+class VerificationFailed(Exception):
+    """Output sospetto (durata, stream o dimensione) anche dopo il nuovo tentativo"""
+
+
+@dataclass
+class RunningProcess:
+    """Processo avviato dal ProcessRunner e i task che ne gestiscono le pipe"""
+    process: object
+    stderr_task: object
+    feed_task: object = None
+    timer: object = None
+    timed_out: bool = False
+
+
+class ProcessRunner:
+    """Esegue i processi ffmpeg su un event loop asyncio dedicato
+    
+    I worker (thread) restano sincroni e attendono il risultato, mentre il
+    loop gestisce le pipe, limita i processi simultanei, applica le scadenze,
+    legge il `-progress` di ffmpeg in tempo reale e termina tutti i processi
+    in corso se il batch viene annullato.
+    """
+    # Chiavi del blocco -progress di ffmpeg (separate dal resto dello stderr)
+    PROGRESS_KEYS = {b'frame', b'fps', b'bitrate', b'total_size', b'out_time_us',
+                     b'out_time_ms', b'out_time', b'dup_frames', b'drop_frames',
+                     b'speed', b'progress'}
+    
+    def __init__(self, max_processes: Optional[int] = None):
+        self.max_processes = max(1, max_processes or os.cpu_count() or 4)
+        self.loop = None
+        self.semaphore = None
+        self.processes = set()
+        self.cancelled = threading.Event()
+        self.lock = threading.Lock()
+    
+    def ensure_loop(self):
+        """Avvia il thread dell'event loop al primo processo"""
+        with self.lock:
+            if self.loop is None:
+                import asyncio
+                loop = self.loop = asyncio.new_event_loop()
+                
+                def serve():
+                    loop.run_forever()
+                    loop.close()
+                
+                threading.Thread(target=serve, daemon=True).start()
+    
+    def call(self, coro):
+        """Esegue una coroutine sul loop e ne attende il risultato"""
+        import asyncio
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+    
+    def run(self, cmd: List[str], input: Optional[bytes] = None,
+            deadline: Optional[float] = None, on_progress=None, on_stdout=None,
+            chunk_size: int = 1 << 20) -> subprocess.CompletedProcess:
+        """Esegue `cmd` (stdout/stderr in bytes)
+        
+        `on_progress(secondi)` riceve l'out_time del -progress; `on_stdout(chunk)`,
+        se passato, consuma lo stdout a blocchi nel thread chiamante invece di
+        accumularlo. Solleva TimeoutExpired oltre la scadenza e JobCancelled se
+        il batch è stato annullato.
+        """
+        if self.cancelled.is_set():
+            raise JobCancelled()
+        self.ensure_loop()
+        job = self.call(self.spawn(cmd, input, deadline, on_progress))
+        stdout = b''
+        try:
+            if on_stdout is None:
+                stdout = self.call(job.process.stdout.read())
+            else:
+                while True:
+                    chunk = self.call(self.read_block(job.process.stdout, chunk_size))
+                    if not chunk:
+                        break
+                    on_stdout(chunk)
+        except BaseException:
+            self.loop.call_soon_threadsafe(self.kill, job.process)
+            self.call(self.finish(job))
+            raise
+        returncode, stderr = self.call(self.finish(job))
+        if job.timed_out:
+            raise subprocess.TimeoutExpired(cmd, deadline)
+        if self.cancelled.is_set() and returncode != 0:
+            raise JobCancelled()
+        return subprocess.CompletedProcess(cmd, returncode, stdout, stderr)
+    
+    def cancel(self):
+        """Annulla il batch: termina i processi in corso e rifiuta i successivi"""
+        self.cancelled.set()
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(
+                lambda: [self.kill(process) for process in list(self.processes)]
+            )
+    
+    def close(self):
+        """Ferma l'event loop"""
+        with self.lock:
+            if self.loop is not None:
+                self.loop.call_soon_threadsafe(self.loop.stop)
+                self.loop = None
+    
+    async def spawn(self, cmd: List[str], input: Optional[bytes],
+                    deadline: Optional[float], on_progress) -> RunningProcess:
+        import asyncio
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_processes)
+        await self.semaphore.acquire()
+        try:
+            if self.cancelled.is_set():
+                raise JobCancelled()
+            # Gruppo di processi separato (POSIX): l'annullamento termina anche
+            # eventuali processi figli, e Ctrl+C arriva solo al programma
+            process = await asyncio.create_subprocess_exec(
+                *cmd, stdin=subprocess.PIPE if input is not None else subprocess.DEVNULL,
+                stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                start_new_session=os.name == 'posix'
+            )
+        except BaseException:
+            self.semaphore.release()
+            raise
+        self.processes.add(process)
+        job = RunningProcess(process, asyncio.ensure_future(
+            self.read_stderr(process.stderr, on_progress)))
+        if input is not None:
+            job.feed_task = asyncio.ensure_future(self.feed(process.stdin, input))
+        if deadline:
+            job.timer = asyncio.get_running_loop().call_later(deadline, self.expire, job)
+        return job
+    
+    async def finish(self, job: RunningProcess):
+        """Attende la fine del processo e libera lo slot; ritorna (exit code, stderr)"""
+        try:
+            if job.feed_task is not None:
+                await job.feed_task
+            stderr = await job.stderr_task
+            await job.process.wait()
+        finally:
+            if job.timer is not None:
+                job.timer.cancel()
+            self.processes.discard(job.process)
+            self.semaphore.release()
+        return job.process.returncode, stderr
+    
+    @staticmethod
+    async def read_block(stream, size: int) -> bytes:
+        """Legge esattamente `size` byte (meno solo a fine stream)"""
+        import asyncio
+        try:
+            return await stream.readexactly(size)
+        except asyncio.IncompleteReadError as e:
+            return e.partial
+    
+    async def read_stderr(self, stream, on_progress) -> bytes:
+        """Legge lo stderr riga per riga: il -progress va a `on_progress`, il resto è restituito"""
+        lines = []
+        while True:
+            line = await stream.readline()
+            if not line:
+                break
+            key, sep, value = line.strip().partition(b'=')
+            if sep and (key in self.PROGRESS_KEYS or key.startswith(b'stream_')):
+                if key == b'out_time_us' and on_progress is not None and value.isdigit():
+                    on_progress(int(value) / 1e6)
+                continue
+            lines.append(line)
+        return b''.join(lines)
+    
+    @staticmethod
+    async def feed(stream, data: bytes):
+        """Scrive i dati su stdin e lo chiude (ffmpeg può chiuderlo prima)"""
+        try:
+            stream.write(data)
+            await stream.drain()
+            stream.close()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+    
+    def expire(self, job: RunningProcess):
+        job.timed_out = True
+        self.kill(job.process)
+    
+    @staticmethod
+    def kill(process):
+        try:
+            if os.name == 'posix':
+                os.killpg(process.pid, signal.SIGKILL)
+            else:
+                process.kill()
+        except ProcessLookupError:
+            pass
+
 
 class MusicNormalizer:
-    def __init__(self, target_lufs: float = -16.0):
+    # Codec audio copiabili senza ricodifica dai video, con il contenitore audio adatto
+    COPY_CONTAINERS = {
+        'aac': '.m4a',
+        'alac': '.m4a',
+        'opus': '.opus',
+    }
+    
+    # Codec di output selezionabili: estensione e argomenti encoder
+    OUTPUT_CODECS = {
+        'aac': ('.m4a', ['-c:a', 'aac', '-b:a', '192k']),
+        'mp3': ('.mp3', ['-c:a', 'libmp3lame', '-b:a', '320k']),
+        'opus': ('.opus', ['-c:a', 'libopus', '-b:a', '160k']),
+        'flac': ('.flac', ['-c:a', 'flac']),
+        'wav': ('.wav', ['-c:a', 'pcm_s16le']),
+    }
+    
+    # Encoder per mantenere il codec sorgente (solo quelli con bitrate impostabile
+    # ricevono -b:a, i lossless mantengono la profondità in bit)
+    PROFILE_ENCODERS = {
+        'mp3': 'libmp3lame',
+        'vorbis': 'libvorbis',
+        'opus': 'libopus',
+        'aac': 'aac',
+        'wmav2': 'wmav2',
+        'flac': 'flac',
+        'alac': 'alac',
+    }
+    LOSSY_CODECS = {'mp3', 'vorbis', 'opus', 'aac', 'wmav2'}
+    # Il muxer mov scarta i tag non standard senza -movflags use_metadata_tags
+    MP4_FORMATS = {'.m4a', '.mp4', '.m4v', '.mov'}
+    # Formati che non possono contenere i tag ReplayGain (RIFF INFO, ADTS):
+    # in modalità tags ricevono il guadagno
+    UNTAGGABLE_FORMATS = {'.wav', '.aac'}
+    # Contenitori audio in cui ffmpeg mantiene la copertina (stream video allegato)
+    COVER_ART_FORMATS = {'.mp3', '.flac', '.m4a'}
+    # Scadenza dei processi ffmpeg: base + secondi per secondo di audio (>= 2x tempo reale)
+    DEADLINE_BASE = 60.0
+    DEADLINE_FACTOR = 0.5
+    # Riga del framelog di ebur128: tempo e momentary loudness (blocco da 400 ms)
+    EBUR128_FRAME = re.compile(r't:\s*([\d.]+)\s+TARGET:\S+ LUFS\s+M:\s*(-?[\d.]+)')
+    # Verifica degli output: tolleranza sulla durata (secondi + frazione della
+    # durata), dimensione minima delle ricodifiche con bitrate impostato (frazione
+    # del bitrate, al massimo 200 byte/s: anche il silenzio codificato in
+    # Opus/Vorbis ne occupa di più) e tentativi per output sospetti
+    VERIFY_DURATION_TOLERANCE = (0.5, 0.01)
+    VERIFY_MIN_BITRATE_FRACTION = 0.01
+    VERIFY_MIN_BYTES_PER_SECOND = 200
+    VERIFY_RETRIES = 1
+    # Controllo a campione del loudness: segmenti, durata (s) e scarto ammesso (LU)
+    VERIFY_SEGMENTS = 3
+    VERIFY_SEGMENT_SECONDS = 10.0
+    VERIFY_LOUDNESS_TOLERANCE = 2.0
+    # Cache su disco del probe di ffmpeg/ffprobe (valida finché l'eseguibile non cambia)
+    TOOL_CACHE_VERSION = 1
+    # Probe già letti in questo processo, per chiave (la GUI verifica ffmpeg a ogni batch)
+    tool_probes = {}
+    # Righe di `ffmpeg -encoders` (solo audio) e `ffmpeg -filters`
+    ENCODER_LINE = re.compile(r'^ A[.A-Z]{5} (\w\S*)', re.M)
+    FILTER_LINE = re.compile(r'^ [.A-Z]{3} (\S+)\s+\S+->\S+', re.M)
+    MP3_BITRATES = (32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320)
+    
+    def __init__(self, target_lufs: float = -16.0, true_peak: float = -1.5, lra: float = 11.0):
         self.target_lufs = target_lufs
+        self.true_peak = true_peak
+        self.lra = lra
+        self.cache = None
+        self.ffmpeg_version = ''
+        self.ffprobe_path = None
+        # Encoder audio e filtri della build di ffmpeg (vuoti = non noti)
+        self.encoders = set()
+        self.filters = set()
+        self.index = None
         self.supported_formats = {
             # Audio
             '.mp3', '.flac', '.wav', '.m4a', '.ogg', '.opus', '.aac', '.wma',
@@ -20,84 +1036,1004 @@ class MusicNormalizer:
             '.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v'
         }
         self.video_formats = {'.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v'}
+        # Codec di output forzato (None = mantieni il formato, video -> AAC)
+        self.output_codec = None
+        # Thread per decoder/encoder di ogni processo ffmpeg (0 = automatico)
+        self.ffmpeg_threads = 0
+        # Modalità: 'loudnorm' (two-pass), 'gain' (volume statico se non serve
+        # il limitatore) o 'tags' (solo tag ReplayGain/R128, audio invariato)
+        self.mode = 'loudnorm'
+        # Motore di analisi: 'loudnorm' (filtro ffmpeg) o 'numpy' (R128Analyzer)
+        self.analysis_engine = 'loudnorm'
+        # Sample rate di output: 'source' (come la sorgente) o un valore fisso in Hz
+        self.sample_rate_policy = 'source'
+        # Decodifica unica: il PCM dell'analisi alimenta anche la codifica finale
+        self.decode_once = False
+        self.pcm_budget = PcmBudget()
+        # Cartella per i buffer PCM che non entrano nel budget (None = temp di sistema)
+        self.scratch_dir = None
+        # Esecuzione dei processi ffmpeg (asyncio) e avanzamento dentro ogni file:
+        # progress_hook(report, fase, frazione)
+        self.runner = ProcessRunner()
+        self.progress_hook = None
+        # Verifica degli output: 'off', 'metadata' (durata, stream e dimensione
+        # da ffprobe) o 'loudness' (anche loudness di pochi segmenti)
+        self.verify_output = 'metadata'
+        # Modalità album: None (per traccia), 'dir' (gruppi per cartella) o 'tag'
+        # (tag album/album artist); le misure includono l'istogramma dei blocchi
+        self.album_mode = None
         
-    def get_ffmpeg_path(self) -> str:
-        """Trova ffmpeg embedded o nel sistema"""
+    def find_tool(self, name: str) -> str:
+        """Trova un eseguibile ffmpeg/ffprobe embedded o nel sistema"""
         # Se siamo un exe PyInstaller
         if getattr(sys, 'frozen', False):
             bundle_dir = Path(sys._MEIPASS)
-            ffmpeg_embedded = bundle_dir / 'ffmpeg.exe'
-            if ffmpeg_embedded.exists():
-                return str(ffmpeg_embedded)
+            tool_embedded = bundle_dir / f'{name}.exe'
+            if tool_embedded.exists():
+                return str(tool_embedded)
         
         # Nella stessa directory dello script/exe
         script_dir = Path(sys.executable if getattr(sys, 'frozen', False) else __file__).parent
-        ffmpeg_local = script_dir / 'ffmpeg.exe'
-        if ffmpeg_local.exists():
-            return str(ffmpeg_local)
+        tool_local = script_dir / f'{name}.exe'
+        if tool_local.exists():
+            return str(tool_local)
         
         # Nel PATH di sistema
-        return 'ffmpeg'
+        return name
     
-    def check_ffmpeg(self) -> Tuple[bool, str]:
-        """Verifica che ffmpeg sia disponibile"""
-        ffmpeg_path = self.get_ffmpeg_path()
+    def get_ffmpeg_path(self) -> str:
+        """Trova ffmpeg embedded o nel sistema"""
+        return self.find_tool('ffmpeg')
+    
+    def get_ffprobe_path(self) -> str:
+        """Trova ffprobe embedded o nel sistema"""
+        return self.find_tool('ffprobe')
+    
+    @staticmethod
+    def tool_cache_path() -> Path:
+        """File JSON con i probe di ffmpeg/ffprobe nella cartella cache dell'utente"""
+        base = os.environ.get('LOCALAPPDATA') or os.environ.get('XDG_CACHE_HOME')
+        return Path(base or Path.home() / '.cache') / 'music-normalizer' / 'tools.json'
+    
+    @staticmethod
+    def tool_fingerprint(tool_path: str) -> Optional[Tuple[str, list]]:
+        """Chiave e firma [dimensione, mtime] dell'eseguibile (None se non trovato)
+        
+        Gli eseguibili del bundle PyInstaller sono estratti in una cartella
+        temporanea nuova a ogni avvio: per loro vale la firma dell'exe.
+        """
+        import shutil
+        found = shutil.which(tool_path)
+        if found is None:
+            return None
+        resolved = os.path.realpath(found)
+        key = stat_path = resolved
+        if getattr(sys, 'frozen', False) and Path(resolved).parent == Path(sys._MEIPASS).resolve():
+            stat_path = sys.executable
+            key = f'{Path(resolved).name}@{os.path.realpath(sys.executable)}'
+        try:
+            st = os.stat(stat_path)
+        except OSError:
+            return None
+        return key, [st.st_size, st.st_mtime_ns]
+    
+    @classmethod
+    def load_tool_cache(cls) -> dict:
+        """Probe salvati su disco per chiave (vuoto se assente o di un'altra versione)"""
         try:
-            subprocess.run([ffmpeg_path, '-version'], 
-                         capture_output=True, 
-                         check=True,
-                         timeout=5)
-            return True, ffmpeg_path
+            data = json.loads(cls.tool_cache_path().read_text(encoding='utf-8'))
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(data, dict) or data.get('version') != cls.TOOL_CACHE_VERSION:
+            return {}
+        return data.get('tools') or {}
+    
+    @classmethod
+    def save_tool_cache(cls, key: str, probe: dict):
+        """Aggiunge un probe alla cache su disco (scrittura atomica, errori ignorati)"""
+        path = cls.tool_cache_path()
+        tools = cls.load_tool_cache()
+        tools[key] = probe
+        partial = path.with_name(f'{path.name}.{os.getpid()}-{threading.get_ident()}.partial')
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            partial.write_text(json.dumps({'version': cls.TOOL_CACHE_VERSION, 'tools': tools}),
+                               encoding='utf-8')
+            os.replace(partial, path)
+        except OSError:
+            pass
+    
+    def probe_tool(self, tool_path: str, capabilities: bool = False) -> Optional[dict]:
+        """Versione dell'eseguibile e, per ffmpeg, encoder audio e filtri disponibili"""
+        def run(*args) -> str:
+            return subprocess.run([tool_path, '-hide_banner', *args],
+                                  capture_output=True,
+                                  check=True,
+                                  text=True,
+                                  errors='replace',
+                                  timeout=5).stdout
+        try:
+            probe = {'version': run('-version').split('\n', 1)[0].strip()}
+            if capabilities:
+                probe['encoders'] = self.ENCODER_LINE.findall(run('-encoders'))
+                probe['filters'] = self.FILTER_LINE.findall(run('-filters'))
         except Exception:
+            return None
+        return probe
+    
+    def tool_info(self, tool_path: str, capabilities: bool = False) -> Optional[dict]:
+        """Probe dell'eseguibile dalla cache (processo, poi disco), rieseguito se è cambiato"""
+        fingerprint = self.tool_fingerprint(tool_path)
+        if fingerprint is None:
+            return None
+        key, signature = fingerprint
+        probe = self.tool_probes.get(key) or self.load_tool_cache().get(key)
+        if (probe is None or probe.get('signature') != signature
+                or (capabilities and 'encoders' not in probe)):
+            probe = self.probe_tool(tool_path, capabilities)
+            if probe is None:
+                return None
+            probe['signature'] = signature
+            self.save_tool_cache(key, probe)
+        self.tool_probes[key] = probe
+        return probe
+    
+    def check_ffmpeg(self) -> Tuple[bool, str]:
+        """Verifica che ffmpeg sia disponibile (e ffprobe, opzionale)
+        
+        Versione, encoder e filtri restano in cache finché l'eseguibile non
+        cambia: agli avvii successivi la verifica non lancia processi.
+        """
+        ffmpeg_path = self.get_ffmpeg_path()
+        info = self.tool_info(ffmpeg_path, capabilities=True)
+        if info is None:
             return False, None
+        self.ffmpeg_version = info['version']
+        self.encoders = set(info['encoders'])
+        self.filters = set(info['filters'])
+        
+        # ffprobe serve solo per le ottimizzazioni: senza, si usa il percorso standard
+        ffprobe_path = self.get_ffprobe_path()
+        self.ffprobe_path = ffprobe_path if self.tool_info(ffprobe_path) is not None else None
+        return True, ffmpeg_path
+    
+    def has_encoder(self, name: str) -> bool:
+        """Encoder presente nella build di ffmpeg (True se le capacità non sono note)"""
+        return not self.encoders or name in self.encoders
+    
+    def has_filter(self, name: str) -> bool:
+        """Filtro presente nella build di ffmpeg (True se le capacità non sono note)"""
+        return not self.filters or name in self.filters
+    
+    def check_capabilities(self) -> Optional[str]:
+        """Motivo per cui questa build di ffmpeg non può eseguire la configurazione"""
+        if (self.mode == 'loudnorm' or self.analysis_engine == 'loudnorm') and not self.has_filter('loudnorm'):
+            return "ffmpeg non include il filtro loudnorm"
+        if self.output_codec is not None:
+            encoder = self.OUTPUT_CODECS[self.output_codec][1][1]
+            if not self.has_encoder(encoder):
+                return f"ffmpeg non include l'encoder {encoder} (codec {self.output_codec})"
+        return None
+    
+    def probe_file(self, file_path: Path) -> Optional[dict]:
+        """Metadati del file dall'indice della libreria, o da ffprobe se non indicizzato"""
+        if self.index is not None:
+            found, probe = self.index.lookup(file_path)
+            if found:
+                return probe
+        probe = self.run_ffprobe(file_path)
+        # Solo risultati certi: un errore di ffprobe (timeout, share di rete
+        # momentaneamente irraggiungibile) si riprova al prossimo avvio
+        if self.index is not None and probe is not None:
+            self.index.put(file_path, probe)
+        return probe
+    
+    def run_ffprobe(self, file_path: Path) -> Optional[dict]:
+        """Legge formato e stream del file con ffprobe (senza decodificare)"""
+        if self.ffprobe_path is None:
+            return None
+        cmd = [
+            self.ffprobe_path,
+            '-v', 'warning',
+            '-show_format',
+            '-show_streams',
+            '-of', 'json',
+            str(file_path)
+        ]
+        try:
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+            if result.returncode != 0:
+                return None
+            probe = json.loads(result.stdout)
+        except (subprocess.TimeoutExpired, json.JSONDecodeError):
+            return None
+        # Durata calcolata dal bitrate (es. MP3 VBR senza header Xing): solo indicativa
+        if 'Estimating duration from bitrate' in result.stderr and 'format' in probe:
+            probe['format']['duration_estimated'] = True
+        return probe
+
+    @staticmethod
+    def get_duration(probe: Optional[dict]) -> Optional[float]:
+        """Durata in secondi dai metadati del contenitore"""
+        try:
+            return float(probe['format']['duration'])
+        except (KeyError, TypeError, ValueError):
+            return None
+    
+    @staticmethod
+    def get_audio_stream(probe: Optional[dict]) -> Optional[dict]:
+        """Primo stream audio del file, se presente"""
+        if not probe:
+            return None
+        for stream in probe.get('streams', []):
+            if stream.get('codec_type') == 'audio':
+                return stream
+        return None
+    
+    @classmethod
+    def get_album_tags(cls, probe: Optional[dict]) -> dict:
+        """Tag album/album artist del contenitore o del primo stream audio (Ogg, Opus)"""
+        if not probe:
+            return {}
+        tags = LibraryIndex.compact_tags(probe.get('format', {}).get('tags'))
+        stream = cls.get_audio_stream(probe)
+        if stream is not None:
+            for name, value in LibraryIndex.compact_tags(stream.get('tags')).items():
+                tags.setdefault(name, value)
+        return tags
     
-    def get_audio_files(self, folder: Path) -> List[Path]:
+    def get_audio_files(self, folder: Path, recursive: bool = False) -> List[Path]:
         """Trova tutti i file audio/video nella cartella"""
-        audio_files = []
+        return sorted(self.iter_audio_files(folder, recursive=recursive))
+    
+    def iter_audio_files(self, folder: Path, recursive: bool = False,
+                         include: Optional[List[str]] = None, exclude: Optional[List[str]] = None,
+                         follow_symlinks: bool = False, skip_dirs: Tuple[Path, ...] = (),
+                         on_error=None):
+        """Genera i file audio/video man mano che li trova (os.scandir, anche ricorsivo)
         
-        for file in folder.iterdir():
-            if file.is_file() and file.suffix.lower() in self.supported_formats:
-                audio_files.append(file)
+        I pattern glob di include/exclude valgono sul percorso relativo (con '/')
+        o sul solo nome del file.
+        """
+        def matches(rel: str, name: str, patterns: List[str]) -> bool:
+            return any(fnmatch.fnmatch(rel, p) or fnmatch.fnmatch(name, p) for p in patterns)
         
-        return sorted(audio_files)
+        skip = {os.path.normcase(os.path.realpath(d)) for d in skip_dirs}
+        visited = set()
+        stack = [Path(folder)]
+        while stack:
+            directory = stack.pop()
+            try:
+                # Evita i cicli quando si seguono i link simbolici
+                st = directory.stat()
+                if (st.st_dev, st.st_ino) in visited:
+                    continue
+                visited.add((st.st_dev, st.st_ino))
+                with os.scandir(directory) as entries:
+                    entries = sorted(entries, key=lambda e: e.name)
+            except OSError as e:
+                if on_error:
+                    on_error(directory, e)
+                continue
+            
+            subdirs = []
+            for entry in entries:
+                try:
+                    if entry.is_symlink() and not follow_symlinks:
+                        continue
+                    path = Path(entry.path)
+                    rel = path.relative_to(folder).as_posix()
+                    if entry.is_dir():
+                        if (recursive and os.path.normcase(os.path.realpath(path)) not in skip
+                                and not (exclude and matches(rel, entry.name, exclude))):
+                            subdirs.append(path)
+                        continue
+                    if not entry.is_file() or path.suffix.lower() not in self.supported_formats:
+                        continue
+                except OSError as e:
+                    if on_error:
+                        on_error(Path(entry.path), e)
+                    continue
+                if include and not matches(rel, entry.name, include):
+                    continue
+                if exclude and matches(rel, entry.name, exclude):
+                    continue
+                yield path
+            # Ordine alfabetico anche tra le sottocartelle (visita in profondità)
+            stack.extend(reversed(subdirs))
     
-    def measure_loudness(self, file_path: Path, ffmpeg_path: str) -> Tuple[float, float]:
-        """Misura il loudness integrato del file"""
+    def analyze_loudness(self, file_path: Path, ffmpeg_path: str,
+                         report: Optional[dict] = None) -> Optional[LoudnessStats]:
+        """Misura il loudness con una sola decodifica (statistiche per il two-pass)"""
+        if self.analysis_engine == 'numpy':
+            return self.analyze_loudness_numpy(file_path, ffmpeg_path, report=report)
+        
         cmd = [
             ffmpeg_path,
+            *self.thread_args(),
             '-i', str(file_path),
-            '-af', 'loudnorm=print_format=json',
+            # Solo la traccia audio: nei video non si decodificano i fotogrammi
+            '-map', '0:a:0',
+            '-af', self.analysis_filter(),
+            '-f', 'null',
+            '-',
+            # Copia dei pacchetti senza decodifica: l'out_time del -progress è la
+            # durata reale (quello di loudnorm resta indietro del suo lookahead)
+            '-map', '0:a:0',
+            '-c:a', 'copy',
             '-f', 'null',
             '-'
         ]
         
-        result = subprocess.run(cmd, 
-                              capture_output=True, 
-                              text=True,
-                              timeout=300)
+        result = self.run_stage(cmd, 'analysis', report, timeout=300, read_path=file_path)
         
-        output = result.stderr
+        return self.parse_analysis(result.stderr.decode('utf-8', 'replace'), result.out_time)
+    
+    def analyze_loudness_numpy(self, file_path: Path, ffmpeg_path: str, timeout: float = 300,
+                               report: Optional[dict] = None) -> Optional[LoudnessStats]:
+        """Misura EBU R128 in-process: ffmpeg decodifica in PCM float, NumPy analizza a blocchi"""
+        import numpy as np
+        stream = self.get_audio_stream(self.probe_file(file_path))
+        channels = int(stream['channels']) if stream and stream.get('channels') else 2
+        cmd = [
+            ffmpeg_path,
+            *self.thread_args(),
+            '-i', str(file_path),
+            '-map', '0:a:0',
+            '-ac', str(channels),
+            '-ar', str(R128Analyzer.SAMPLE_RATE),
+            '-f', 'f32le',
+            '-'
+        ]
         
-        integrated = None
-        true_peak = None
+        analyzer = R128Analyzer(channels)
+        frame_bytes = 4 * channels
         
-        for line in output.split('\n'):
-            if '"input_i"' in line:
-                try:
-                    integrated = float(line.split(':')[1].strip().rstrip(',').strip('"'))
-                except ValueError:
-                    pass
-            elif '"input_tp"' in line:
-                try:
-                    true_peak = float(line.split(':')[1].strip().rstrip(',').strip('"'))
-                except ValueError:
-                    pass
+        def consume(data):
+            data = data[:len(data) - len(data) % frame_bytes]
+            analyzer.process(np.frombuffer(data, dtype='<f4').reshape(-1, channels))
+        
+        # Lo stdout arriva a blocchi nel thread del worker: memoria limitata
+        result = self.run_stage(cmd, 'analysis', report, timeout=timeout, read_path=file_path,
+                                on_stdout=consume, chunk_size=R128Analyzer.CHUNK * frame_bytes)
+        if result.returncode != 0:
+            return None
+        stats = analyzer.result(blocks=self.album_mode is not None)
+        if stats is not None and result.out_time:
+            stats.duration = round(result.out_time, 3)
+        return stats
+    
+    def decode_pcm(self, file_path: Path, ffmpeg_path: str, log_callback=None,
+                   timeout: float = 600, report: Optional[dict] = None) -> Optional[PcmBuffer]:
+        """Decodifica la sorgente in PCM float al suo sample rate e numero di canali
+        
+        Il buffer resta in RAM se la stima (durata × rate × canali, più un
+        secondo di margine) rientra nel budget condiviso, altrimenti viene
+        scritto nella cartella di scratch. La decodifica in RAM si ferma alla
+        dimensione riservata: se la durata era sottostimata si passa al disco.
+        """
+        import tempfile
+        probe = self.probe_file(file_path)
+        stream = self.get_audio_stream(probe)
+        if stream is None:
+            return None
+        channels = int(stream.get('channels') or 2)
+        sample_rate = int(stream.get('sample_rate') or 48000)
+        duration = self.get_duration(probe)
+        
+        cmd = [
+            ffmpeg_path,
+            *self.thread_args(),
+            '-i', str(file_path),
+            '-map', '0:a:0',
+            '-ac', str(channels),
+            '-ar', str(sample_rate),
+            '-f', 'f32le',
+        ]
+        
+        estimate = int((duration + 1) * sample_rate * channels * 4) if duration else 0
+        if estimate and self.pcm_budget.try_reserve(estimate):
+            try:
+                # -fs: mai oltre la memoria riservata
+                result = self.run_stage(cmd + ['-fs', str(estimate), '-'], 'decode', report,
+                                        timeout=timeout, read_path=file_path)
+            except BaseException:
+                self.pcm_budget.release(estimate)
+                raise
+            if result.returncode != 0:
+                self.pcm_budget.release(estimate)
+                return None
+            size = len(result.stdout)
+            if size < estimate:
+                # Il budget tiene conto della dimensione reale del buffer
+                self.pcm_budget.release(estimate - size)
+                return PcmBuffer(sample_rate, channels, data=result.stdout,
+                                 budget=self.pcm_budget, reserved=size)
+            # Decodifica troncata al limite: la durata dichiarata era sbagliata
+            self.pcm_budget.release(estimate)
+            del result
+        
+        # Durata sconosciuta o sottostimata, budget esaurito: PCM su disco
+        if log_callback:
+            log_callback("  (buffer PCM su disco)")
+        fd, name = tempfile.mkstemp(suffix='.f32', prefix='pcm-', dir=self.scratch_dir)
+        os.close(fd)
+        pcm = PcmBuffer(sample_rate, channels, path=Path(name))
+        try:
+            result = self.run_stage(cmd + ['-y', name], 'decode', report, timeout=timeout,
+                                    read_path=file_path, write_path=pcm.path)
+        except BaseException:
+            pcm.release()
+            raise
+        if result.returncode != 0:
+            pcm.release()
+            return None
+        return pcm
+    
+    def analyze_pcm(self, pcm: PcmBuffer, ffmpeg_path: str,
+                    report: Optional[dict] = None) -> Optional[LoudnessStats]:
+        """Misura il loudness dal PCM già decodificato (nessuna nuova decodifica)"""
+        if self.analysis_engine == 'numpy':
+            start, cpu_start = time.perf_counter(), time.thread_time()
+            analyzer = R128Analyzer(pcm.channels, pcm.sample_rate)
+            frames = pcm.frames()
+            for offset in range(0, len(frames), R128Analyzer.CHUNK):
+                analyzer.process(frames[offset:offset + R128Analyzer.CHUNK])
+            # Analisi in-process: CPU del thread worker
+            self.record_stage(report, 'analysis', time.perf_counter() - start,
+                              time.thread_time() - cpu_start, pcm.size)
+            stats = analyzer.result(blocks=self.album_mode is not None)
+            if stats is not None:
+                stats.duration = round(len(frames) / pcm.sample_rate, 3)
+            return stats
+        
+        cmd = [
+            ffmpeg_path,
+            *self.thread_args(),
+            *pcm.input_args(),
+            '-af', self.analysis_filter(),
+            '-f', 'null',
+            '-'
+        ]
+        result = self.run_stage(cmd, 'analysis', report, input=pcm.stdin_data(), timeout=300,
+                                read_path=pcm.path)
+        return self.parse_analysis(result.stderr.decode('utf-8', 'replace'), result.out_time)
+    
+    def analysis_filter(self) -> str:
+        """Filtro di analisi: loudnorm, preceduto da ebur128 se servono i blocchi (album)"""
+        loudnorm = (f'loudnorm=I={self.target_lufs}:TP={self.true_peak}:'
+                    f'LRA={self.lra}:print_format=json')
+        if self.album_mode is None:
+            return loudnorm
+        return f'ebur128=framelog=info,{loudnorm}'
+    
+    def parse_analysis(self, output: str, out_time: float = 0.0) -> Optional[LoudnessStats]:
+        """Misure dallo stderr dell'analisi (istogramma dei blocchi in modalità album)"""
+        stats = self.parse_loudnorm_stats(output)
+        if stats is not None and self.album_mode is not None:
+            stats.blocks = self.parse_block_histogram(output)
+        if stats is not None and out_time:
+            stats.duration = round(out_time, 3)
+        return stats
+    
+    @classmethod
+    def parse_block_histogram(cls, output: str) -> List[List[int]]:
+        """Istogramma dei blocchi da 400 ms dal framelog di ebur128 (valore M ogni 100 ms)"""
+        # Prima di 0.4 s la finestra del momentary non è ancora piena
+        levels = [float(level) for t, level in cls.EBUR128_FRAME.findall(output) if float(t) >= 0.39]
+        return R128Analyzer.block_histogram(levels)
+    
+    @staticmethod
+    def parse_loudnorm_stats(output: str) -> Optional[LoudnessStats]:
+        """Estrae il blocco JSON di loudnorm dallo stderr di ffmpeg"""
+        json_start = output.rfind('{')
+        json_end = output.rfind('}') + 1
+        if json_start == -1 or json_end <= json_start:
+            return None
+        
+        try:
+            loudness_stats = json.loads(output[json_start:json_end])
+            return LoudnessStats(
+                input_i=float(loudness_stats['input_i']),
+                input_tp=float(loudness_stats['input_tp']),
+                input_lra=float(loudness_stats['input_lra']),
+                input_thresh=float(loudness_stats['input_thresh']),
+                target_offset=float(loudness_stats.get('target_offset', 0.0)),
+            )
+        except (json.JSONDecodeError, KeyError, TypeError, ValueError):
+            return None
+    
+    def thread_args(self) -> List[str]:
+        """Argomenti -threads per ffmpeg (vuoto se automatico)"""
+        if self.ffmpeg_threads > 0:
+            return ['-threads', str(self.ffmpeg_threads)]
+        return []
+    
+    @staticmethod
+    def record_stage(report: Optional[dict], stage: str, wall: float, cpu: Optional[float],
+                     bytes_read: int = 0, bytes_written: int = 0, exit_status=None):
+        """Aggiunge la misura di una fase a report['stages']"""
+        if report is None:
+            return
+        report.setdefault('stages', []).append({
+            'stage': stage,
+            'wall': round(wall, 3),
+            'cpu': round(cpu, 3) if cpu is not None else None,
+            'bytes_read': bytes_read,
+            'bytes_written': bytes_written,
+            'exit_status': exit_status,
+        })
+    
+    def deadline(self, duration: Optional[float], fallback: float) -> float:
+        """Tempo massimo di un processo: proporzionale alla durata se nota"""
+        if not duration:
+            return fallback
+        return self.DEADLINE_BASE + self.DEADLINE_FACTOR * duration
+    
+    @staticmethod
+    def parse_cpu_time(stderr: bytes) -> Optional[float]:
+        """Tempo CPU del processo dalla riga `bench:` di ffmpeg -benchmark"""
+        match = re.search(rb'bench: utime=([\d.]+)s stime=([\d.]+)s', stderr)
+        if match is None:
+            return None
+        return float(match.group(1)) + float(match.group(2))
+    
+    def run_stage(self, cmd: List[str], stage: str, report: Optional[dict] = None,
+                  input: Optional[bytes] = None, timeout: float = 600,
+                  read_path: Optional[Path] = None, write_path: Optional[Path] = None,
+                  on_stdout=None, chunk_size: int = 1 << 20) -> subprocess.CompletedProcess:
+        """Esegue una fase ffmpeg sul runner: tempo, CPU, byte ed exit status in `report`
+        
+        La scadenza è proporzionale a report['duration'] (`timeout` se ignota) e
+        l'avanzamento del -progress va a `progress_hook`. stdout/stderr sono bytes;
+        `result.out_time` è l'ultimo out_time del -progress (secondi, 0 se assente).
+        """
+        duration = report.get('duration') if report is not None else None
+        written = [0]
+        out_time = [0.0]
+        
+        def on_progress(seconds):
+            out_time[0] = seconds
+            if self.progress_hook is not None and duration:
+                self.progress_hook(report, stage, min(1.0, seconds / duration))
+        
+        def consume(chunk):
+            written[0] += len(chunk)
+            on_stdout(chunk)
+        
+        # -benchmark stampa il tempo CPU del processo (anche su Windows)
+        cmd = [cmd[0], '-hide_banner', '-nostats', '-benchmark', '-progress', 'pipe:2', *cmd[1:]]
+        start = time.perf_counter()
+        status, cpu = None, None
+        try:
+            result = self.runner.run(cmd, input=input,
+                                     deadline=self.deadline(duration, timeout),
+                                     on_progress=on_progress,
+                                     on_stdout=consume if on_stdout is not None else None,
+                                     chunk_size=chunk_size)
+            status, cpu = result.returncode, self.parse_cpu_time(result.stderr)
+            written[0] += len(result.stdout)
+            result.out_time = out_time[0]
+            return result
+        except subprocess.TimeoutExpired:
+            status = 'timeout'
+            raise
+        except JobCancelled:
+            status = 'cancelled'
+            raise
+        finally:
+            bytes_read = len(input) if input is not None else 0
+            if read_path is not None and read_path.exists():
+                bytes_read += read_path.stat().st_size
+            if write_path is not None and write_path.exists():
+                written[0] += write_path.stat().st_size
+            self.record_stage(report, stage, time.perf_counter() - start, cpu,
+                              bytes_read, written[0], status)
+    
+    def get_params(self) -> str:
+        """Parametri di misura (chiave per la cache)"""
+        params = f'I={self.target_lufs}:TP={self.true_peak}:LRA={self.lra}:engine={self.analysis_engine}'
+        # Le misure per traccia non hanno l'istogramma dei blocchi: voci separate
+        return params + ':blocks' if self.album_mode is not None else params
+    
+    def get_output_path(self, input_path: Path, output_path: Path) -> Path:
+        """Percorso di output finale (i video diventano .m4a)"""
+        if self.output_codec is not None:
+            return output_path.with_suffix(self.OUTPUT_CODECS[self.output_codec][0])
+        if input_path.suffix.lower() in self.video_formats:
+            return output_path.with_suffix('.m4a')
+        return output_path
+    
+    @staticmethod
+    def get_partial_path(output_path: Path) -> Path:
+        """Nome temporaneo per la scrittura (rinominato solo a file completo)"""
+        return output_path.with_name(f'.{output_path.stem}.partial{output_path.suffix}')
+    
+    def get_loudness_stats(self, file_path: Path, ffmpeg_path: str, log_callback=None,
+                           pcm_source=None, report: Optional[dict] = None) -> Optional[LoudnessStats]:
+        """Misure loudness dalla cache se disponibili, altrimenti analizza il file
+        
+        `pcm_source`, se passato, viene chiamato solo in caso di analisi e
+        restituisce il PcmBuffer da misurare al posto di una nuova decodifica.
+        """
+        params = self.get_params()
+        if self.cache is not None:
+            stats = self.cache.get(file_path, params)
+            if stats is not None:
+                if log_callback:
+                    log_callback("  (misure dalla cache)")
+                return stats
+        
+        pcm = pcm_source() if pcm_source is not None else None
+        if pcm is not None:
+            stats = self.analyze_pcm(pcm, ffmpeg_path, report)
+        else:
+            stats = self.analyze_loudness(file_path, ffmpeg_path, report)
+        if stats is not None and self.cache is not None:
+            self.cache.put(file_path, params, stats)
+        return stats
+    
+    def measure_loudness(self, file_path: Path, ffmpeg_path: str) -> Tuple[float, float]:
+        """Misura il loudness integrato del file"""
+        stats = self.analyze_loudness(file_path, ffmpeg_path)
+        if stats is None:
+            return None, None
+        return stats.input_i, stats.input_tp
+    
+    def loudnorm_filter(self, stats: Optional[LoudnessStats], target: Optional[float] = None) -> str:
+        """Costruisce il filtro loudnorm (two-pass se ci sono le misure)
+        
+        `target` sostituisce il target globale (modalità album: loudness della
+        traccia + guadagno dell'album), nei limiti accettati da loudnorm.
+        """
+        target = self.target_lufs if target is None else round(min(max(target, -70.0), -5.0), 2)
+        base = f'loudnorm=I={target}:TP={self.true_peak}:LRA={self.lra}'
+        if stats is None:
+            # Single-pass fallback
+            return base
+        
+        # Two-pass normalization
+        return (f'{base}:'
+                f'measured_I={stats.input_i}:'
+                f'measured_TP={stats.input_tp}:'
+                f'measured_LRA={stats.input_lra}:'
+                f'measured_thresh={stats.input_thresh}:'
+                f'offset={stats.target_offset}:'
+                f'linear=true')
+    
+    def output_sample_rate(self, stream: Optional[dict], encoder: Optional[str]) -> str:
+        """Sample rate di output secondo la policy (loudnorm lavora a 192 kHz internamente)"""
+        if encoder == 'libopus':
+            # Opus supporta solo 48 kHz (e sottomultipli)
+            return '48000'
+        if self.sample_rate_policy != 'source':
+            return str(self.sample_rate_policy)
+        if stream and stream.get('sample_rate'):
+            return str(stream['sample_rate'])
+        return '48000'
+    
+    def encode_args(self, input_path: Path, probe: Optional[dict]) -> List[str]:
+        """Profilo di codifica: codec, bitrate, canali e sample rate in base alla sorgente"""
+        stream = self.get_audio_stream(probe)
+        is_video = input_path.suffix.lower() in self.video_formats
+        
+        if is_video or self.output_codec is not None:
+            # Codec di output fisso (AAC per i video se non specificato)
+            args = list(self.OUTPUT_CODECS[self.output_codec or 'aac'][1])
+            encoder = args[1]
+        elif stream is None:
+            # Senza ffprobe: codec predefinito del contenitore
+            return ['-ar', self.output_sample_rate(None, None)]
+        else:
+            codec = stream.get('codec_name', '')
+            encoder = self.PROFILE_ENCODERS.get(codec)
+            if encoder and not self.has_encoder(encoder):
+                # Encoder assente in questa build: quello predefinito del contenitore
+                encoder = None
+            if codec.startswith('pcm_'):
+                encoder = codec
+            args = ['-c:a', encoder] if encoder else []
+            
+            if codec in self.LOSSY_CODECS:
+                bit_rate = stream.get('bit_rate') or (probe.get('format') or {}).get('bit_rate')
+                if bit_rate and str(bit_rate).isdigit():
+                    kbps = max(32, round(int(bit_rate) / 1000))
+                    if codec == 'mp3':
+                        kbps = min(self.MP3_BITRATES, key=lambda b: abs(b - kbps))
+                    args += ['-b:a', f'{kbps}k']
+            elif codec in ('flac', 'alac'):
+                # Mantieni 16 bit per sorgenti a 16 bit (loudnorm produce float)
+                bits = int(stream.get('bits_per_raw_sample') or 0)
+                planar = 'p' if codec == 'alac' else ''
+                args += ['-sample_fmt', f"{'s16' if bits == 16 else 's32'}{planar}"]
+        
+        if stream and stream.get('channels'):
+            args += ['-ac', str(stream['channels'])]
+        args += ['-ar', self.output_sample_rate(stream, encoder)]
+        return args
+    
+    def gain_filter(self, stats: LoudnessStats, gain: Optional[float] = None) -> Optional[str]:
+        """Filtro volume statico se il true peak risultante resta sotto il limite"""
+        if gain is None:
+            gain = self.target_lufs - stats.input_i
+        if stats.input_tp + gain > self.true_peak:
+            return None
+        return f'volume={gain:.2f}dB'
+    
+    def write_gain_tags(self, input_path: Path, output_path: Path, ffmpeg_path: str,
+                        stats: LoudnessStats, partial_path: Path, report: dict, log,
+                        album: Optional[dict] = None) -> bool:
+        """Scrive i tag ReplayGain/R128 copiando gli stream (nessuna ricodifica)"""
+        gain = self.target_lufs - stats.input_i
+        cmd = [ffmpeg_path, '-i', str(input_path), '-map', '0', '-c', 'copy']
+        if input_path.suffix.lower() == '.opus':
+            # RFC 7845: solo R128_*, guadagno Q7.8 rispetto al riferimento di
+            # -23 LUFS; gli eventuali REPLAYGAIN_* della sorgente vengono rimossi
+            label, check = 'R128', 'r128_track_gain'
+            tags = {'R128_TRACK_GAIN': str(round((-23.0 - stats.input_i) * 256))}
+            if album is not None:
+                tags['R128_ALBUM_GAIN'] = str(round((-23.0 - album['loudness']) * 256))
+            for key in ('TRACK_GAIN', 'TRACK_PEAK', 'ALBUM_GAIN', 'ALBUM_PEAK',
+                        'REFERENCE_LOUDNESS'):
+                cmd += ['-metadata:s:a', f'REPLAYGAIN_{key}=']
+        else:
+            label, check = 'ReplayGain', 'replaygain_track_gain'
+            tags = {
+                'REPLAYGAIN_TRACK_GAIN': f'{gain:.2f} dB',
+                'REPLAYGAIN_TRACK_PEAK': f'{10 ** (stats.input_tp / 20):.6f}',
+                'REPLAYGAIN_REFERENCE_LOUDNESS': f'{self.target_lufs:.1f} LUFS',
+            }
+            if album is not None:
+                tags['REPLAYGAIN_ALBUM_GAIN'] = f"{album['gain']:.2f} dB"
+                tags['REPLAYGAIN_ALBUM_PEAK'] = f"{10 ** (album['peak'] / 20):.6f}"
+        
+        for key, value in tags.items():
+            cmd += ['-metadata', f'{key}={value}']
+        if input_path.suffix.lower() in self.MP4_FORMATS:
+            cmd += ['-movflags', 'use_metadata_tags']
+        cmd += ['-y', str(partial_path)]
+        
+        # -map 0: tutti gli stream della sorgente restano nell'output
+        probe = self.probe_file(input_path)
+        audio_streams = sum(1 for st in (probe or {}).get('streams', [])
+                            if st.get('codec_type') == 'audio')
+        result = self.run_verified(cmd, 'tags', report, log, ffmpeg_path, input_path, probe,
+                                   partial_path, audio_streams=audio_streams,
+                                   read_path=input_path, write_path=partial_path)
+        if result.returncode != 0:
+            log("✗ Errore scrittura tag")
+            report['error'] = f'ffmpeg exit code {result.returncode}'
+            return False
+        
+        # Il muxer può scartare i tag senza errori: controlla che ci siano
+        if self.ffprobe_path is not None:
+            written = self.get_tag_names(self.run_ffprobe(partial_path))
+            if check not in written:
+                log(f"✗ Il contenitore non ha conservato i tag {label}")
+                report['error'] = f'tag {label} non salvati'
+                partial_path.unlink()
+                return False
+        
+        os.replace(partial_path, output_path)
+        log(f"✓ Tag {label} scritti ({gain:+.2f} dB): {output_path.name}")
+        report['action'] = 'tagged'
+        return True
+    
+    @staticmethod
+    def get_tag_names(probe: Optional[dict]) -> set:
+        """Nomi (minuscoli) dei tag del contenitore e degli stream"""
+        if not probe:
+            return set()
+        entries = [probe.get('format', {}), *probe.get('streams', [])]
+        return {name.lower() for entry in entries for name in (entry.get('tags') or {})}
+    
+    def album_gain(self, measurements: List[Optional[LoudnessStats]]) -> Optional[dict]:
+        """Loudness, guadagno comune e peak di un album dalle misure delle sue tracce
+        
+        I blocchi di gating di tutte le tracce (istogrammi) passano insieme per i
+        gate assoluto e relativo, come se l'album fosse un unico file: nessuna
+        nuova decodifica.
+        """
+        measured = [stats for stats in measurements if stats is not None and stats.blocks]
+        if not measured:
+            return None
+        combined = collections.Counter()
+        for stats in measured:
+            for level, count in stats.blocks:
+                combined[level] += count
+        loudness = R128Analyzer.histogram_loudness(combined.items())
+        if loudness is None:
+            return None
+        return {
+            'loudness': round(loudness, 2),
+            'gain': round(self.target_lufs - loudness, 2),
+            'peak': max(stats.input_tp for stats in measured),
+            'tracks': len(measured),
+        }
+    
+    def run_verified(self, cmd: List[str], stage: str, report: dict, log, ffmpeg_path: str,
+                     input_path: Path, probe: Optional[dict], partial_path: Path,
+                     audio_streams: int = 1, gain: Optional[float] = None,
+                     bitrate: Optional[int] = None, **kwargs) -> subprocess.CompletedProcess:
+        """Esegue la fase ffmpeg che scrive l'output e lo verifica
+        
+        Un output sospetto (troncato, stream mancanti) viene rifatto fino a
+        VERIFY_RETRIES volte, poi solleva VerificationFailed. Uno scarto di
+        loudness viene solo segnalato: ricodificare darebbe lo stesso risultato.
+        """
+        for attempt in range(1, self.VERIFY_RETRIES + 2):
+            result = self.run_stage(cmd, stage, report, **kwargs)
+            if result.returncode != 0:
+                return result
+            problem = self.verify(ffmpeg_path, input_path, partial_path, probe, report,
+                                  audio_streams, gain, bitrate)
+            if 'verify' in report:
+                report['verify']['attempts'] = attempt
+            if problem is None:
+                if 'flagged' in report.get('verify', {}):
+                    log(f"  ⚠️  Verifica: {report['verify']['flagged']}")
+                return result
+            if attempt <= self.VERIFY_RETRIES:
+                log(f"  ⚠️  Output sospetto ({problem}), nuovo tentativo...")
+                report['verify']['status'] = 'retried'
+        report['verify']['status'] = 'failed'
+        raise VerificationFailed(problem)
+    
+    def verify(self, ffmpeg_path: str, input_path: Path, output_path: Path, probe: Optional[dict],
+               report: dict, audio_streams: int = 1, gain: Optional[float] = None,
+               bitrate: Optional[int] = None) -> Optional[str]:
+        """Confronta l'output con la sorgente dai metadati del contenitore (niente decodifica)
+        
+        `bitrate` (bit/s) è quello impostato alla ricodifica: solo allora la
+        dimensione dell'output ha un minimo. Ritorna il problema trovato, None
+        se l'output è plausibile; i valori misurati vanno in report['verify'].
+        """
+        if self.verify_output == 'off' or self.ffprobe_path is None:
+            return None
+        start = time.perf_counter()
+        output_probe = self.run_ffprobe(output_path)
+        self.record_stage(report, 'verify', time.perf_counter() - start, None)
+        checks = report.setdefault('verify', {'status': 'ok'})
+        if output_probe is None:
+            return 'output non leggibile'
+        
+        streams = [st for st in output_probe.get('streams', []) if st.get('codec_type') == 'audio']
+        checks['audio_streams'] = len(streams)
+        if len(streams) != audio_streams:
+            return f'{len(streams)} stream audio invece di {audio_streams}'
+        
+        # Durata decodificata dall'analisi; senza, quella della traccia audio
+        # sorgente (nei video può differire dal contenitore), che può essere stimata
+        expected = (report.get('stats') or {}).get('duration')
+        if not expected:
+            stream = self.get_audio_stream(probe)
+            try:
+                expected = float(stream['duration'])
+            except (KeyError, TypeError, ValueError):
+                expected = self.get_duration(probe)
+            if (probe or {}).get('format', {}).get('duration_estimated'):
+                # Stima dal bitrate: nessun confronto affidabile sulla durata
+                checks['duration_estimated'] = True
+                expected = None
+        duration = self.get_duration(output_probe)
+        checks['duration'] = duration
+        checks['expected_duration'] = expected
+        if duration is not None and expected is not None:
+            # Solo l'output troncato è un errore (più lungo: padding dell'encoder)
+            seconds, fraction = self.VERIFY_DURATION_TOLERANCE
+            if expected - duration > seconds + fraction * expected:
+                return f'durata {duration:.1f}s invece di {expected:.1f}s'
         
-        return integrated, true_peak
+        size = output_path.stat().st_size
+        checks['size'] = size
+        if duration and bitrate:
+            floor = min(bitrate / 8 * self.VERIFY_MIN_BITRATE_FRACTION,
+                        self.VERIFY_MIN_BYTES_PER_SECOND)
+            if size < floor * duration:
+                return f'solo {size} byte per {duration:.0f}s di audio'
+        
+        span = expected or duration
+        if self.verify_output == 'loudness' and gain is not None and span:
+            before = self.sample_loudness(ffmpeg_path, input_path, span, report)
+            after = self.sample_loudness(ffmpeg_path, output_path, span, report)
+            # Segmenti quasi silenziosi: il confronto non è significativo
+            if before is not None and after is not None and before > -60:
+                checks['loudness_delta'] = round(after - before, 2)
+                checks['expected_gain'] = round(gain, 2)
+                if abs(after - before - gain) > self.VERIFY_LOUDNESS_TOLERANCE:
+                    checks['status'] = 'flagged'
+                    checks['flagged'] = f'loudness {after - before:+.1f} dB invece di {gain:+.1f} dB'
+        return None
+    
+    def verify_segments(self, duration: float) -> List[Tuple[float, float]]:
+        """(inizio, durata) dei segmenti per il controllo a campione (file corti: tutto)"""
+        length = self.VERIFY_SEGMENT_SECONDS
+        count = self.VERIFY_SEGMENTS
+        if duration <= 2 * count * length:
+            return [(0.0, duration)]
+        return [(duration * (i + 1) / (count + 1) - length / 2, length) for i in range(count)]
+    
+    def sample_loudness(self, ffmpeg_path: str, file_path: Path, duration: float,
+                        report: Optional[dict] = None) -> Optional[float]:
+        """Integrated loudness (ebur128) dei soli segmenti di controllo, concatenati"""
+        segments = self.verify_segments(duration)
+        cmd = [ffmpeg_path, *self.thread_args()]
+        for start, length in segments:
+            cmd += ['-ss', f'{start:.3f}', '-t', f'{length:.3f}', '-i', str(file_path)]
+        graph = (''.join(f'[{i}:a:0]' for i in range(len(segments)))
+                 + f'concat=n={len(segments)}:v=0:a=1,ebur128')
+        cmd += ['-filter_complex', graph, '-vn', '-f', 'null', '-']
+        result = self.run_stage(cmd, 'verify', report, timeout=120)
+        values = re.findall(r'^\s+I:\s+(-?[\d.]+) LUFS', result.stderr.decode('utf-8', 'replace'),
+                            re.MULTILINE)
+        if result.returncode != 0 or not values:
+            return None
+        return float(values[-1])
+    
+    def copy_audio_stream(self, input_path: Path, output_path: Path, ffmpeg_path: str,
+                          probe: Optional[dict], report: dict, log) -> bool:
+        """Remux della traccia audio di un video (-c:a copy) se il codec lo permette"""
+        stream = self.get_audio_stream(probe)
+        if stream is None or stream.get('codec_name') not in self.COPY_CONTAINERS:
+            return False
+        
+        copy_path = output_path.with_suffix(self.COPY_CONTAINERS[stream['codec_name']])
+        partial_path = self.get_partial_path(copy_path)
+        cmd = [
+            ffmpeg_path,
+            '-i', str(input_path),
+            '-map', f"0:{stream['index']}",
+            '-vn', '-sn', '-dn',
+            '-c:a', 'copy',
+            '-y',
+            str(partial_path)
+        ]
+        try:
+            result = self.run_verified(cmd, 'stream_copy', report, log, ffmpeg_path, input_path,
+                                       probe, partial_path, read_path=input_path,
+                                       write_path=partial_path)
+            if result.returncode != 0:
+                log("  ⚠️  Copia dello stream fallita, ricodifica...")
+                return False
+            os.replace(partial_path, copy_path)
+        except VerificationFailed:
+            log("  ⚠️  Copia dello stream sospetta, ricodifica...")
+            report['verify']['status'] = 'retried'
+            return False
+        finally:
+            if partial_path.exists():
+                partial_path.unlink()
+        
+        log(f"✓ Già normalizzato, audio estratto senza ricodifica: {copy_path.name}")
+        report['output'] = str(copy_path)
+        report['action'] = 'stream_copied'
+        return True
+    
+    def encode_follows(self, input_path: Path, output_path: Path, is_video: bool) -> bool:
+        """Vero se dopo l'analisi segue sicuramente una codifica
+        
+        Copia (stesso formato) ed estrazione dello stream audio dei video si
+        decidono solo dopo la misura (scarto entro ±1 LU), la modalità tag non
+        ricodifica: in questi casi decodificare il PCM in anticipo è inutile.
+        """
+        if self.output_codec is not None:
+            return output_path.suffix.lower() != input_path.suffix.lower()
+        return not is_video and self.mode != 'tags' and \
+            output_path.suffix.lower() != input_path.suffix.lower()
     
     def normalize_file(self, input_path: Path, output_path: Path, 
-                      ffmpeg_path: str, log_callback=None) -> bool:
-        """Normalizza un singolo file"""
+                      ffmpeg_path: str, log_callback=None, report=None,
+                      stats: Optional[LoudnessStats] = None, album: Optional[dict] = None) -> bool:
+        """Normalizza un singolo file (dettagli del risultato in `report`, se passato)
+        
+        `stats` sono misure già fatte (modalità album, nessuna nuova analisi);
+        `album` (da `album_gain()`) sostituisce il guadagno della traccia con
+        quello comune dell'album.
+        """
+        partial_path = None
+        pcm = None
+        if report is None:
+            report = {}
         try:
             def log(msg):
                 if log_callback:
@@ -110,143 +2046,1171 @@ class MusicNormalizer:
             # Se è un video, converti in audio
             is_video = input_path.suffix.lower() in self.video_formats
             if is_video:
-                log(f"⚙️  Rilevato video, estrazione audio...")
-                # Cambia estensione output in .m4a
-                output_path = output_path.with_suffix('.m4a')
+                log("⚙️  Rilevato video, estrazione audio...")
+            # Cambia estensione output in .m4a per i video
+            output_path = self.get_output_path(input_path, output_path)
+            report['output'] = str(output_path)
+            # Scrive su un file temporaneo e rinomina a fine lavoro: un file
+            # interrotto non viene mai scambiato per un output completo
+            partial_path = self.get_partial_path(output_path)
+            
+            # Formato sorgente (codec, sample rate, canali, bitrate); la durata
+            # determina le scadenze dei processi ffmpeg
+            probe = self.probe_file(input_path)
+            if report.get('duration') is None:
+                report['duration'] = self.get_duration(probe)
             
-            # Misura loudness (First pass)
-            log("📊 Analisi loudness (Pass 1/2)...")
-            integrated, true_peak = self.measure_loudness(input_path, ffmpeg_path)
+            # Analisi (Pass 1): una sola decodifica fornisce sia il loudness
+            # attuale sia i parametri misurati per il two-pass
+            if stats is None:
+                log("📊 Analisi loudness (Pass 1/2)...")
+                # Il PCM decodificato per l'analisi viene riusato dalla codifica
+                def decode():
+                    nonlocal pcm
+                    pcm = self.decode_pcm(input_path, ffmpeg_path, log_callback, report=report)
+                    return pcm
+                decode_ahead = self.decode_once and self.encode_follows(input_path, output_path,
+                                                                        is_video)
+                stats = self.get_loudness_stats(input_path, ffmpeg_path, log_callback,
+                                                decode if decode_ahead else None, report)
             
-            if integrated is None or integrated < -70:
-                log(f"⚠️  Impossibile misurare loudness (file silenzioso o corrotto?)")
+            if stats is None or stats.input_i < -70:
+                log("⚠️  Impossibile misurare loudness (file silenzioso o corrotto?)")
+                report['error'] = 'loudness non misurabile'
                 return False
+            # L'istogramma dei blocchi serve solo al calcolo dell'album
+            report['stats'] = {k: v for k, v in asdict(stats).items() if k != 'blocks'}
             
-            log(f"  Loudness attuale: {integrated:.1f} LUFS")
-            log(f"  True Peak: {true_peak:.1f} dBTP")
+            log(f"  Loudness attuale: {stats.input_i:.1f} LUFS")
+            log(f"  True Peak: {stats.input_tp:.1f} dBTP")
             log(f"  Target: {self.target_lufs:.1f} LUFS")
             
-            adjustment = self.target_lufs - integrated
+            if album is not None:
+                # Stesso guadagno per tutte le tracce: restano i dislivelli dell'album
+                adjustment = album['gain']
+                report['album'] = {k: album[k] for k in ('name', 'loudness', 'gain') if k in album}
+                log(f"  Loudness album: {album['loudness']:.1f} LUFS")
+            else:
+                adjustment = self.target_lufs - stats.input_i
             log(f"  Aggiustamento: {adjustment:+.1f} dB")
             
-            # Se già nel range accettabile (±1 LU) e non è video, copia
-            if abs(adjustment) < 1.0 and not is_video:
-                log(f"✓ Già normalizzato, copiato")
+            # Solo tag: l'audio resta invariato, nessuna codifica;
+            # i tag vanno scritti anche se il file è già nel range
+            mode = self.mode
+            if mode == 'tags' and not is_video and self.output_codec is None:
+                if input_path.suffix.lower() not in self.UNTAGGABLE_FORMATS:
+                    return self.write_gain_tags(input_path, output_path, ffmpeg_path,
+                                                stats, partial_path, report, log, album)
+                log("  Il formato non supporta i tag ReplayGain, applico il guadagno")
+                mode = 'gain'
+            
+            # Se già nel range accettabile (±1 LU) e il formato non cambia, copia
+            if abs(adjustment) < 1.0 and output_path.suffix.lower() == input_path.suffix.lower():
+                log("✓ Già normalizzato, copiato")
                 import shutil
-                shutil.copy2(input_path, output_path)
+                start = time.perf_counter()
+                shutil.copy2(input_path, partial_path)
+                size = partial_path.stat().st_size
+                os.replace(partial_path, output_path)
+                self.record_stage(report, 'copy', time.perf_counter() - start, None, size, size)
+                report['action'] = 'copied'
                 return True
             
-            # Normalizza con two-pass loudnorm
-            log("⚙️  Normalizzazione (Pass 2/2)...")
-            
-            # First pass: Get detailed loudness stats for two-pass normalization
-            first_pass_cmd = [
-                ffmpeg_path,
-                '-i', str(input_path),
-                '-af', f'loudnorm=I={self.target_lufs}:TP=-1.5:LRA=11:print_format=json',
-                '-f', 'null',
-                '-'
-            ]
-            
-            first_pass_result = subprocess.run(first_pass_cmd, 
-                                              capture_output=True, 
-                                              text=True,
-                                              timeout=600)
-            
-            # Parse first pass output to get measured parameters
-            output = first_pass_result.stderr
-            measured_i = None
-            measured_tp = None
-            measured_lra = None
-            measured_thresh = None
-            
-            # Extract JSON section from output
-            try:
-                # Find the JSON block in stderr
-                json_start = output.rfind('{')
-                json_end = output.rfind('}') + 1
-                if json_start != -1 and json_end > json_start:
-                    json_str = output[json_start:json_end]
-                    loudness_stats = json.loads(json_str)
-                    measured_i = loudness_stats.get('input_i')
-                    measured_tp = loudness_stats.get('input_tp')
-                    measured_lra = loudness_stats.get('input_lra')
-                    measured_thresh = loudness_stats.get('input_thresh')
-            except (json.JSONDecodeError, ValueError) as e:
-                # If parsing fails, fall back to single-pass
-                log(f"  ⚠️  Two-pass parsing failed ({str(e)}), using single-pass mode")
-                measured_i = None
+            # Video già nel range: estrai la traccia audio senza ricodificarla
+            if abs(adjustment) < 1.0 and is_video and self.output_codec is None:
+                if self.copy_audio_stream(input_path, output_path, ffmpeg_path,
+                                          probe, report, log):
+                    return True
+            
+            # Solo guadagno: volume statico se c'è headroom, altrimenti serve
+            # il limitatore di loudnorm
+            filter_str = None
+            if mode == 'gain':
+                filter_str = self.gain_filter(stats, adjustment)
+                if filter_str is None:
+                    log("  Headroom insufficiente, uso loudnorm con limitatore")
+            
+            if filter_str is not None:
+                log(f"⚙️  Applicazione guadagno {adjustment:+.1f} dB (Pass 2/2)...")
+                action = 'gain'
+            else:
+                # Normalizza con two-pass loudnorm usando le misure del Pass 1
+                log("⚙️  Normalizzazione (Pass 2/2)...")
+                filter_str = self.loudnorm_filter(
+                    stats, stats.input_i + adjustment if album is not None else None)
+                action = 'normalized'
+            
+            # Sorgente della codifica: il PCM già decodificato (metadati, capitoli
+            # e copertina dal file originale) oppure il file stesso
+            if pcm is not None:
+                source_args = [*pcm.input_args(), '-i', str(input_path),
+                               '-map', '0:a', '-map_metadata', '1', '-map_chapters', '1']
+                if (not is_video and self.output_codec is None
+                        and input_path.suffix.lower() in self.COVER_ART_FORMATS):
+                    source_args += ['-map', '1:v?', '-c:v', 'copy']
+            else:
+                source_args = ['-i', str(input_path)]
             
             # Second pass: Apply normalization with measured parameters
-            if is_video:
-                # Estrai audio e normalizza
-                if measured_i is not None:
-                    # Two-pass normalization
-                    filter_str = (f'loudnorm=I={self.target_lufs}:TP=-1.5:LRA=11:'
-                                f'measured_I={measured_i}:'
-                                f'measured_TP={measured_tp}:'
-                                f'measured_LRA={measured_lra}:'
-                                f'measured_thresh={measured_thresh}:'
-                                f'linear=true')
-                else:
-                    # Single-pass fallback
-                    filter_str = f'loudnorm=I={self.target_lufs}:TP=-1.5:LRA=11'
-                
+            if is_video or self.output_codec is not None:
+                # Estrai audio e normalizza (AAC per i video se non specificato)
                 cmd = [
                     ffmpeg_path,
-                    '-i', str(input_path),
+                    *self.thread_args(),
+                    *source_args,
                     '-vn',  # No video
                     '-af', filter_str,
-                    '-c:a', 'aac',
-                    '-b:a', '192k',
-                    '-ar', '48000',
+                    *self.encode_args(input_path, probe),
+                    *self.thread_args(),
                     '-y',
-                    str(output_path)
+                    str(partial_path)
                 ]
             else:
-                # Normalizza audio mantenendo formato
-                if measured_i is not None:
-                    # Two-pass normalization
-                    filter_str = (f'loudnorm=I={self.target_lufs}:TP=-1.5:LRA=11:'
-                                f'measured_I={measured_i}:'
-                                f'measured_TP={measured_tp}:'
-                                f'measured_LRA={measured_lra}:'
-                                f'measured_thresh={measured_thresh}:'
-                                f'linear=true')
-                else:
-                    # Single-pass fallback
-                    filter_str = f'loudnorm=I={self.target_lufs}:TP=-1.5:LRA=11'
-                
+                # Normalizza audio mantenendo formato e profilo della sorgente
                 cmd = [
                     ffmpeg_path,
-                    '-i', str(input_path),
+                    *self.thread_args(),
+                    *source_args,
                     '-af', filter_str,
-                    '-ar', '48000',
+                    *self.encode_args(input_path, probe),
+                    *self.thread_args(),
                     '-y',
-                    str(output_path)
+                    str(partial_path)
                 ]
             
-            result = subprocess.run(cmd, 
-                                  capture_output=True, 
-                                  text=True,
-                                  timeout=600)
+            # Bitrate impostato (es. '192k'): minimo di dimensione per la verifica
+            bitrate = None
+            if '-b:a' in cmd:
+                bitrate = int(cmd[cmd.index('-b:a') + 1].rstrip('k')) * 1000
+            
+            result = self.run_verified(cmd, 'encode', report, log, ffmpeg_path, input_path, probe,
+                                       partial_path, gain=adjustment, bitrate=bitrate,
+                                       input=pcm.stdin_data() if pcm is not None else None,
+                                       read_path=pcm.path if pcm is not None else input_path,
+                                       write_path=partial_path)
             
             if result.returncode == 0:
+                os.replace(partial_path, output_path)
                 log(f"✓ Completato: {output_path.name}")
+                report['action'] = action
                 return True
             else:
-                log(f"✗ Errore normalizzazione")
+                log("✗ Errore normalizzazione")
+                report['error'] = f'ffmpeg exit code {result.returncode}'
                 return False
                 
         except subprocess.TimeoutExpired:
-            log(f"✗ Timeout (file troppo grande?)")
+            log("✗ Timeout (file troppo grande?)")
+            report['error'] = 'timeout'
+            return False
+        except JobCancelled:
+            log(f"⏹ Annullato: {input_path.name}")
+            report['error'] = 'annullato'
+            return False
+        except VerificationFailed as e:
+            log(f"✗ Verifica dell'output fallita: {e}")
+            report['error'] = f'verifica fallita: {e}'
             return False
         except Exception as e:
             log(f"✗ Errore: {str(e)}")
+            report['error'] = str(e)
             return False
+        finally:
+            if pcm is not None:
+                pcm.release()
+            if partial_path is not None and partial_path.exists():
+                partial_path.unlink()
+
+
+class DuplicateFinder:
+    """Trova i file con lo stesso contenuto audio, per elaborarne uno solo
+    
+    Tra file della stessa dimensione si confronta un hash parziale (inizio e
+    fine del file) e, solo se coincide, l'hash completo. Tra contenitori
+    diversi (un video e l'audio estratto, MP4 e MKV) con stesso codec, formato
+    e durata dall'indice ffprobe si confronta l'hash dei primi pacchetti dello
+    stream audio copiato da ffmpeg e, solo se coincide, quello di tutto lo
+    stream, senza decodifica.
+    """
+    PARTIAL_BYTES = 64 * 1024
+    # Scarto massimo di durata tra contenitori diversi dello stesso stream (secondi)
+    DURATION_TOLERANCE = 0.5
+    # Pacchetti audio dell'hash parziale dello stream (~5 s di MP3/AAC)
+    HEAD_PACKETS = 200
+    
+    def __init__(self, normalizer: MusicNormalizer, ffmpeg_path: str, max_workers: int = 4):
+        self.normalizer = normalizer
+        self.ffmpeg_path = ffmpeg_path
+        self.max_workers = max_workers
+        # Tempi delle impronte (fase 'fingerprint' nel riepilogo)
+        self.report = {'stages': []}
+    
+    @classmethod
+    def partial_hash(cls, file_path: Path) -> str:
+        """Hash di dimensione, primi e ultimi PARTIAL_BYTES del file"""
+        import hashlib
+        digest = hashlib.blake2b(digest_size=20)
+        size = file_path.stat().st_size
+        digest.update(str(size).encode())
+        with open(file_path, 'rb') as f:
+            digest.update(f.read(cls.PARTIAL_BYTES))
+            if size > cls.PARTIAL_BYTES:
+                f.seek(max(cls.PARTIAL_BYTES, size - cls.PARTIAL_BYTES))
+                digest.update(f.read())
+        return digest.hexdigest()
+    
+    def stream_hash(self, file_path: Path, packets: Optional[int] = None) -> Optional[str]:
+        """Hash dei pacchetti del primo stream audio (uguale in contenitori diversi)
+        
+        Con `packets` solo i primi pacchetti: un confronto economico prima
+        dell'hash di tutto lo stream.
+        """
+        cmd = [self.ffmpeg_path, '-i', str(file_path), '-map', '0:a:0', '-c', 'copy']
+        if packets is not None:
+            cmd += ['-frames:a', str(packets)]
+        cmd += ['-f', 'hash', '-hash', 'sha256', '-']
+        try:
+            result = self.normalizer.run_stage(cmd, 'fingerprint', self.report, timeout=300,
+                                               read_path=file_path)
+        except subprocess.TimeoutExpired:
+            return None
+        output = result.stdout.decode('ascii', 'replace').strip()
+        if result.returncode != 0 or not output.startswith('SHA256='):
+            return None
+        return output
+    
+    def hashed(self, hash_file, files: List[Path], stage_bytes=None) -> dict:
+        """file -> hash calcolato in parallelo (None se illeggibile)"""
+        def job(file):
+            start = time.perf_counter()
+            size = 0
+            try:
+                size = stage_bytes(file) if stage_bytes is not None else 0
+                return hash_file(file)
+            except OSError:
+                return None
+            finally:
+                if stage_bytes is not None:
+                    self.normalizer.record_stage(self.report, 'fingerprint',
+                                                 time.perf_counter() - start, None, size)
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            return dict(zip(files, executor.map(job, files)))
+    
+    @classmethod
+    def near_in_duration(cls, entries: List[Tuple[float, Path]]) -> List[Path]:
+        """File con un altro file entro DURATION_TOLERANCE (vicini diretti, nessuna catena)"""
+        entries = sorted(entries, key=lambda entry: entry[0])
+        return [file for i, (duration, file) in enumerate(entries)
+                if (i > 0 and duration - entries[i - 1][0] <= cls.DURATION_TOLERANCE)
+                or (i + 1 < len(entries) and entries[i + 1][0] - duration <= cls.DURATION_TOLERANCE)]
+    
+    def find(self, files: List[Path]) -> List[List[Path]]:
+        """Gruppi di file con lo stesso contenuto (almeno due file ciascuno)"""
+        keys = {}
+        
+        # Stessi byte: dimensione, poi hash parziale, poi hash completo
+        by_size = collections.defaultdict(list)
+        for file in files:
+            try:
+                by_size[file.stat().st_size].append(file)
+            except OSError:
+                continue
+        candidates = [file for group in by_size.values() if len(group) > 1 for file in group]
+        partial = self.hashed(self.partial_hash, candidates,
+                              lambda f: min(f.stat().st_size, 2 * self.PARTIAL_BYTES))
+        by_partial = collections.defaultdict(list)
+        for file, digest in partial.items():
+            if digest is not None:
+                by_partial[digest].append(file)
+        candidates = [file for group in by_partial.values() if len(group) > 1 for file in group]
+        full = self.hashed(MeasurementCache.content_hash, candidates, lambda f: f.stat().st_size)
+        for file, digest in full.items():
+            if digest is not None:
+                keys[file] = f'bytes:{digest}'
+        
+        # Stesso stream audio in contenitori diversi: codec, formato e durata
+        # simili dall'indice (un file per contenuto), poi l'hash dei primi
+        # pacchetti e, solo tra quelli uguali, l'hash di tutto lo stream
+        by_format = collections.defaultdict(dict)
+        durations = {}
+        for file in files:
+            probe = self.normalizer.probe_file(file) if self.normalizer.index is not None else None
+            stream = self.normalizer.get_audio_stream(probe)
+            duration = self.normalizer.get_duration(probe)
+            if stream is not None and duration is not None:
+                signature = (stream.get('codec_name'), stream.get('sample_rate'), stream.get('channels'))
+                by_format[signature].setdefault(keys.get(file, file), file)
+                durations[file] = duration
+        candidates = [file for group in by_format.values()
+                      for file in self.near_in_duration([(durations[f], f) for f in group.values()])]
+        heads = self.hashed(lambda f: self.stream_hash(f, self.HEAD_PACKETS), candidates)
+        by_head = collections.defaultdict(list)
+        for file, digest in heads.items():
+            if digest is not None:
+                by_head[digest].append((durations[file], file))
+        candidates = [file for group in by_head.values() if len(group) > 1
+                      for file in self.near_in_duration(group)]
+        streams = self.hashed(self.stream_hash, candidates)
+        aliases = {}
+        for file, digest in streams.items():
+            if digest is not None:
+                aliases[keys.get(file, file)] = f'audio:{digest}'
+        
+        groups = collections.defaultdict(list)
+        for file in files:
+            key = keys.get(file, file)
+            groups[aliases.get(key, key)].append(file)
+        # Originale: preferibilmente un file audio (i video costano di più), poi per nome
+        return [sorted(group, key=lambda f: (f.suffix.lower() in self.normalizer.video_formats,
+                                             str(f)))
+                for group in groups.values() if len(group) > 1]
+
+
+class JobScheduler:
+    """Dimensiona la concorrenza su core e tipo di job e ordina i job (più lunghi prima)"""
+    
+    def __init__(self, normalizer: MusicNormalizer, max_workers: Optional[int] = None,
+                 max_video_jobs: Optional[int] = None, cpu_count: Optional[int] = None):
+        self.normalizer = normalizer
+        cores = cpu_count or os.cpu_count() or 4
+        # Decodifica + loudnorm sono quasi sequenziali: un worker per core,
+        # e i thread ffmpeg si dividono i core restanti se i worker sono meno
+        self.max_workers = max(1, max_workers or cores)
+        self.ffmpeg_threads = max(1, cores // self.max_workers)
+        # Le estrazioni da video leggono file grandi: limite separato per non saturare il disco
+        self.max_video_jobs = max(1, max_video_jobs or self.max_workers // 4)
+        # Tempo di attesa in coda di ogni job (da scoperta ad avvio) e tempo
+        # passato dal dispatcher in attesa del pool
+        self.queue_wait = {}
+        self.pool_wait = 0.0
+    
+    def is_video(self, file: Path) -> bool:
+        return file.suffix.lower() in self.normalizer.video_formats
+    
+    def job_cost(self, file: Path) -> float:
+        """Stima del costo di un job: durata dall'indice, altrimenti dalla dimensione"""
+        if self.normalizer.index is not None:
+            duration = self.normalizer.get_duration(self.normalizer.probe_file(file))
+            if duration is not None:
+                return duration
+        try:
+            # ~128 kbps: stessa unità (secondi) della durata
+            return file.stat().st_size / 16000
+        except OSError:
+            return 0
+    
+    def order(self, files: List[Path]) -> List[Path]:
+        """Longest-job-first: i file più grandi partono subito e non restano in coda al batch"""
+        return sorted(files, key=self.job_cost, reverse=True)
+    
+    def run(self, files, job):
+        """Esegue job(file) sul pool e restituisce (file, future) man mano che terminano
+        
+        `files` può essere un generatore: i job partono mentre la scansione è
+        ancora in corso, e l'ordine longest-job-first vale sulla finestra di
+        file già scoperti.
+        """
+        lookahead = self.max_workers * 4
+        feed = queue.Queue(maxsize=lookahead)
+        end_of_feed = object()
+        producer_error = []
+        
+        def producer():
+            try:
+                for file in files:
+                    feed.put(file)
+            except Exception as e:
+                producer_error.append(e)
+            finally:
+                feed.put(end_of_feed)
+        
+        threading.Thread(target=producer, daemon=True).start()
+        
+        seq = itertools.count()
+        audio_heap, video_heap = [], []
+        in_flight = {}
+        running_video = 0
+        exhausted = False
+        
+        def starved():
+            """Worker liberi ma nessun job in attesa ammesso (solo video, già al limite)"""
+            return (not audio_heap and running_video >= self.max_video_jobs
+                    and len(in_flight) < self.max_workers)
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while True:
+                # Preleva i file scoperti (bloccante solo se non c'è nulla da fare)
+                while not exhausted:
+                    # A finestra piena si legge oltre solo se nessun job in attesa è
+                    # ammesso (video al limite) e ci sono worker liberi: gli audio
+                    # dietro una fila di video non devono restare fuori
+                    if len(audio_heap) + len(video_heap) >= lookahead and not starved():
+                        break
+                    idle = not (in_flight or audio_heap or video_heap)
+                    try:
+                        file = feed.get(block=idle)
+                    except queue.Empty:
+                        break
+                    if file is end_of_feed:
+                        exhausted = True
+                        break
+                    heap = video_heap if self.is_video(file) else audio_heap
+                    heapq.heappush(heap, (-self.job_cost(file), next(seq), time.perf_counter(), file))
+                
+                # Riempi gli slot liberi: il job più costoso tra quelli ammessi
+                while len(in_flight) < self.max_workers:
+                    video_ok = video_heap and running_video < self.max_video_jobs
+                    if video_ok and (not audio_heap or video_heap[0] <= audio_heap[0]):
+                        _, _, queued, file = heapq.heappop(video_heap)
+                        running_video += 1
+                    elif audio_heap:
+                        _, _, queued, file = heapq.heappop(audio_heap)
+                    else:
+                        break
+                    self.queue_wait[file] = time.perf_counter() - queued
+                    in_flight[executor.submit(job, file)] = file
+                
+                if not in_flight:
+                    if exhausted and not audio_heap and not video_heap:
+                        break
+                    continue
+                if not exhausted and starved() and not feed.empty():
+                    # Altri file già scoperti possono occupare i worker liberi
+                    continue
+                
+                # Attesa breve se la scansione continua, per accodare nuovi file
+                wait_start = time.perf_counter()
+                done, _ = concurrent.futures.wait(
+                    in_flight, timeout=None if exhausted else 0.2,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                )
+                self.pool_wait += time.perf_counter() - wait_start
+                for future in done:
+                    file = in_flight.pop(future)
+                    if self.is_video(file):
+                        running_video -= 1
+                    yield file, future
+        
+        if producer_error:
+            raise producer_error[0]
+
+
+class BatchEngine:
+    """Motore di elaborazione batch indipendente dalla GUI (usato da GUI e CLI)"""
+    # File più lenti riportati nel riepilogo
+    SLOWEST_FILES = 10
+    # Colonne del report CSV (una riga per fase di ogni file)
+    CSV_FIELDS = ('input', 'status', 'action', 'duration', 'elapsed', 'queue_wait',
+                  'stage', 'wall', 'cpu', 'bytes_read', 'bytes_written', 'exit_status')
+    # Parte del singolo file coperta da ogni fase: (inizio, peso)
+    STAGE_PROGRESS = {
+        'decode': (0.0, 0.5), 'analysis': (0.0, 0.5),
+        'encode': (0.5, 0.5), 'tags': (0.5, 0.5), 'stream_copy': (0.5, 0.5),
+    }
+    
+    def __init__(self, normalizer: MusicNormalizer, ffmpeg_path: str,
+                 input_dir: Path, output_dir: Path, max_workers: Optional[int] = None,
+                 max_video_jobs: Optional[int] = None, incremental: bool = False,
+                 cache_path: Optional[Path] = None, index_path: Optional[Path] = None,
+                 cache_options: Optional[dict] = None, recursive: bool = False, include: Optional[List[str]] = None,
+                 exclude: Optional[List[str]] = None, follow_symlinks: bool = False,
+                 report_path: Optional[Path] = None, dedup: Optional[str] = None,
+                 work_queue: Optional[WorkQueue] = None,
+                 queue_role: Optional[str] = None, log_callback=None,
+                 start_callback=None, progress_callback=None, result_callback=None):
+        self.normalizer = normalizer
+        self.ffmpeg_path = ffmpeg_path
+        self.input_dir = input_dir
+        self.output_dir = output_dir
+        self.scheduler = JobScheduler(normalizer, max_workers, max_video_jobs)
+        self.incremental = incremental
+        self.cache_path = cache_path
+        # Parametri della cache misure (max_entries, max_age_days, use_content_hash)
+        self.cache_options = cache_options or {}
+        self.index_path = index_path
+        self.recursive = recursive
+        self.include = include
+        self.exclude = exclude
+        self.follow_symlinks = follow_symlinks
+        # Report dell'esecuzione (.json o .csv) con i tempi per fase di ogni file
+        self.report_path = report_path
+        # Duplicati: None (tutti elaborati), 'link' (hardlink, o copia tra file
+        # system diversi) o 'copy' dell'output dell'originale
+        self.dedup = dedup
+        # Modalità distribuita: 'coordinator' accoda i file e aggrega i risultati,
+        # 'worker' elabora i job presi dalla coda condivisa
+        self.work_queue = work_queue
+        self.queue_role = queue_role
+        import socket
+        self.worker_id = f'{socket.gethostname()}-{os.getpid()}'
+        self.log_callback = log_callback
+        self.start_callback = start_callback
+        self.progress_callback = progress_callback
+        self.result_callback = result_callback
+        self.lock = threading.Lock()
+        self.cancelled = threading.Event()
+    
+    def log(self, message):
+        if self.log_callback:
+            self.log_callback(message)
+    
+    def cancel(self):
+        """Annulla il batch: termina i processi ffmpeg in corso, i file in coda vengono saltati"""
+        if self.cancelled.is_set():
+            return
+        self.cancelled.set()
+        self.log("\n⏹ Annullamento in corso...")
+        self.normalizer.runner.cancel()
+    
+    def stage_progress(self, report: dict, stage: str, fraction: float):
+        """Avanzamento dentro un file (dal -progress di ffmpeg) sommato ai file completati"""
+        start, weight = self.STAGE_PROGRESS.get(stage, (0.0, 1.0))
+        with self.lock:
+            key = report['input']
+            self.partial[key] = max(self.partial.get(key, 0.0), start + weight * fraction)
+            done = self.completed + sum(self.partial.values())
+            total = self.summary['total']
+        if self.progress_callback:
+            self.progress_callback(done, total)
+    
+    def run(self) -> dict:
+        """Elabora i file in parallelo man mano che vengono trovati e ritorna il riepilogo"""
+        summary = {
+            'input_dir': str(self.input_dir),
+            'output_dir': str(self.output_dir),
+            'total': 0, 'success': 0, 'failed': 0, 'skipped': 0,
+            'cache_hits': 0, 'cache_misses': 0,
+            'rejected': 0, 'cancelled': 0, 'total_duration': 0.0,
+            'stages': {}, 'queue_wait': 0.0, 'pool_wait': 0.0, 'slowest': [],
+            'albums': 0, 'workers': {},
+            'duplicates': 0, 'dedup_saved': 0.0, 'dedup_audio': 0.0,
+            'verify_retried': 0, 'verify_flagged': 0, 'verify_failed': 0,
+        }
+        self.summary = summary
+        self.reports = []
+        self.slowest = []
+        self.partial = {}
+        self.completed = 0
+        self.scanning = True
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        # Processi ffmpeg su asyncio: al massimo uno per worker, annullabili
+        self.normalizer.runner = ProcessRunner(self.scheduler.max_workers)
+        self.normalizer.progress_hook = self.stage_progress
+        
+        # Cache misure: i file invariati non vengono rianalizzati
+        if self.cache_path is not None:
+            self.normalizer.cache = MeasurementCache(
+                self.cache_path, ffmpeg_version=self.normalizer.ffmpeg_version,
+                **self.cache_options
+            )
+        # Indice ffprobe della libreria, riusato tra le esecuzioni
+        if self.index_path is not None and self.normalizer.ffprobe_path is not None:
+            self.normalizer.index = LibraryIndex(self.index_path)
+        # Manifest dei job: permette di riprendere batch interrotti (in modalità
+        # distribuita lo stato dei job è nella coda condivisa)
+        self.manifest = None
+        if self.work_queue is None:
+            self.manifest = JobManifest(self.output_dir / ".manifest.db")
+        # Codec di output e modalità fanno parte dei parametri del job
+        self.params = (f'{self.normalizer.get_params()}:mode={self.normalizer.mode}:'
+                       f'codec={self.normalizer.output_codec or "auto"}:'
+                       f'ar={self.normalizer.sample_rate_policy}')
+        if self.normalizer.album_mode is not None:
+            self.params += f':album={self.normalizer.album_mode}'
+        
+        try:
+            self.log(f"\n{'='*60}")
+            self.log("AVVIO ELABORAZIONE PARALLELA")
+            self.log(f"{'='*60}")
+            self.log(f"Cartella: {self.input_dir}{' (con sottocartelle)' if self.recursive else ''}")
+            self.log(f"Output: {self.output_dir}")
+            self.log(f"Target: {self.normalizer.target_lufs} LUFS")
+            if self.normalizer.album_mode is not None:
+                self.log("💿 Modalità album: guadagno comune per "
+                         + ('tag album' if self.normalizer.album_mode == 'tag' else 'cartella'))
+            self.log(f"🚀 Worker paralleli: {self.scheduler.max_workers} "
+                     f"(thread ffmpeg per job: {self.scheduler.ffmpeg_threads}, "
+                     f"video simultanei: {self.scheduler.max_video_jobs})")
+            self.log(f"{'='*60}")
+            
+            # Elaborazione parallela: lo scheduler limita i video e ordina i job,
+            # che partono mentre la scansione è ancora in corso
+            self.normalizer.ffmpeg_threads = self.scheduler.ffmpeg_threads
+            if self.queue_role == 'coordinator':
+                self.run_coordinator()
+            elif self.queue_role == 'worker':
+                self.run_worker()
+            elif self.normalizer.album_mode is not None:
+                if self.dedup is not None:
+                    self.log("⚠️  Ricerca duplicati non disponibile in modalità album")
+                self.run_albums()
+            elif self.dedup is not None:
+                self.run_dedup()
+            else:
+                for file, future in self.scheduler.run(self.iter_jobs(), self.process_single_file):
+                    self.collect(file, future)
+            
+            summary['pool_wait'] = round(self.scheduler.pool_wait, 3)
+            summary['dedup_saved'] = round(summary['dedup_saved'], 3)
+            summary['dedup_audio'] = round(summary['dedup_audio'], 3)
+            summary['queue_wait'] = round(summary['queue_wait'], 3)
+            summary['slowest'] = [report for _, _, report in sorted(self.slowest, reverse=True)]
+            for totals in summary['stages'].values():
+                totals['wall'] = round(totals['wall'], 3)
+                totals['cpu'] = round(totals['cpu'], 3)
+            
+            if self.cancelled.is_set():
+                self.log(f"\n⏹ Elaborazione annullata: {summary['cancelled']} file non completati")
+            if summary['total'] == 0:
+                if summary['skipped'] > 0:
+                    self.log("\n✓ Nessun file nuovo o modificato da elaborare")
+                else:
+                    self.log("\n✗ Nessun file audio/video trovato nella cartella!")
+                    self.log(f"\nCercato in: {self.input_dir}")
+            else:
+                self.log_timing()
+            if self.report_path is not None:
+                self.write_report(self.report_path)
+                self.log(f"📄 Report: {self.report_path}")
+            return summary
+        
+        finally:
+            self.normalizer.runner.close()
+            self.normalizer.progress_hook = None
+            cache = self.normalizer.cache
+            if cache is not None:
+                summary['cache_hits'] = cache.hits
+                summary['cache_misses'] = cache.misses
+                cache.close()
+                self.normalizer.cache = None
+            if self.normalizer.index is not None:
+                self.normalizer.index.close()
+                self.normalizer.index = None
+            if self.manifest is not None:
+                self.manifest.close()
+    
+    def collect(self, file: Path, future: concurrent.futures.Future):
+        """Registra il risultato di un job terminato"""
+        try:
+            report = future.result()
+        except Exception as e:
+            self.log(f"✗ Errore critico per {file.name}: {e}")
+            report = {'input': str(file), 'output': None, 'action': None,
+                      'status': 'failed', 'error': str(e)}
+        self.record(report)
+        return report
+    
+    def run_dedup(self):
+        """Elabora una sola copia di ogni contenuto: i duplicati ricevono l'output
+        dell'originale (hardlink o copia)
+        
+        Le impronte richiedono l'elenco completo dei file, quindi i job partono
+        a scansione terminata.
+        """
+        files = list(self.iter_jobs())
+        finder = DuplicateFinder(self.normalizer, self.ffmpeg_path, self.scheduler.max_workers)
+        start = time.perf_counter()
+        try:
+            groups = finder.find(files)
+        except JobCancelled:
+            groups = []
+        for stage in finder.report['stages']:
+            self.add_stage(stage)
+        
+        # Solo duplicati con la stessa estensione di output prevista dell'originale.
+        # Due video prevedono entrambi .m4a ma lo stream copy può produrre altro
+        # (.opus, .flac): stesso stream, stessa scelta, quindi il duplicato
+        # prende l'estensione reale dell'output dell'originale
+        duplicates = {}
+        for group in groups:
+            suffix = self.normalizer.get_output_path(group[0], group[0]).suffix
+            copies = [file for file in group[1:]
+                      if self.normalizer.get_output_path(file, file).suffix == suffix]
+            if copies:
+                duplicates[group[0]] = copies
+        skipped = {file for copies in duplicates.values() for file in copies}
+        self.log(f"🧬 Impronte calcolate in {time.perf_counter() - start:.1f}s: "
+                 f"{len(skipped)} duplicati di {len(duplicates)} file")
+        
+        unique = [file for file in files if file not in skipped]
+        for file, future in self.scheduler.run(unique, self.process_single_file):
+            report = self.collect(file, future)
+            for copy in duplicates.get(file, []):
+                self.record(self.link_duplicate(copy, report))
+        
+        if self.summary['duplicates']:
+            audio = int(self.summary['dedup_audio'])
+            self.log(f"\n🧬 Duplicati: {self.summary['duplicates']} file senza rielaborazione "
+                     f"(risparmiati {self.summary['dedup_saved']:.1f}s di elaborazione, "
+                     f"{audio // 3600}:{audio % 3600 // 60:02d}:{audio % 60:02d} di audio)")
+    
+    def link_duplicate(self, file: Path, original: dict) -> dict:
+        """Output di un duplicato dall'output dell'originale già elaborato"""
+        output_file = self.normalizer.get_output_path(
+            file, self.output_dir / file.relative_to(self.input_dir))
+        if original.get('output'):
+            output_file = output_file.with_suffix(Path(original['output']).suffix)
+        report = {'input': str(file), 'output': None, 'action': None,
+                  'duplicate_of': original['input'], 'duration': original.get('duration')}
+        start = time.perf_counter()
+        if original['status'] != 'done':
+            # Stesso contenuto: fallirebbe (o è stato annullato) allo stesso modo
+            report.update(status=original['status'], error=f"originale non elaborato: "
+                                                             f"{original.get('error')}")
+        else:
+            output_file.parent.mkdir(parents=True, exist_ok=True)
+            partial_path = self.normalizer.get_partial_path(output_file)
+            try:
+                method = 'copy'
+                if self.dedup == 'link':
+                    try:
+                        os.link(original['output'], partial_path)
+                        method = 'hardlink'
+                    except OSError:
+                        pass
+                if method == 'copy':
+                    import shutil
+                    shutil.copy2(original['output'], partial_path)
+                os.replace(partial_path, output_file)
+                self.normalizer.record_stage(report, 'duplicate', time.perf_counter() - start,
+                                             None, 0, output_file.stat().st_size)
+                self.log(f"🔗 {file.name}: duplicato di {Path(original['input']).name} ({method})")
+                report.update(output=str(output_file), action='duplicate', dedup=method,
+                              status='done')
+                with self.lock:
+                    self.summary['duplicates'] += 1
+                    self.summary['dedup_saved'] += original.get('elapsed', 0.0)
+                    self.summary['dedup_audio'] += report.get('duration') or 0.0
+            except OSError as e:
+                self.log(f"✗ {file.name}: {e}")
+                report.update(status='failed', error=str(e))
+            finally:
+                if partial_path.exists():
+                    partial_path.unlink()
+        if self.manifest is not None:
+            self.manifest.mark(file, self.params, report['status'],
+                               Path(report['output']) if report['output'] else None)
+        report['elapsed'] = round(time.perf_counter() - start, 3)
+        return report
+    
+    def run_albums(self):
+        """Modalità album: misura tutte le tracce, poi codifica con il guadagno del gruppo
+        
+        Il loudness dell'album viene dagli istogrammi dei blocchi misurati per
+        ogni traccia (fase 1), quindi non costa decodifiche in più della modalità
+        per traccia. In modalità incrementale un album con anche una sola traccia
+        nuova o modificata viene rielaborato per intero: il suo guadagno cambia.
+        """
+        measurements = {}
+        for file, future in self.scheduler.run(self.iter_jobs(skip_done=False), self.measure_track):
+            measurements[file] = future.result()
+        
+        groups = collections.defaultdict(list)
+        for file in measurements:
+            groups[self.album_key(file)].append(file)
+        
+        albums = {}
+        pending = []
+        for name, tracks in sorted(groups.items()):
+            album = self.normalizer.album_gain([measurements[file][1] for file in tracks])
+            if album is not None:
+                album['name'] = name
+                self.log(f"💿 {name}: {len(tracks)} tracce, {album['loudness']:.1f} LUFS "
+                         f"→ guadagno {album['gain']:+.1f} dB")
+            else:
+                self.log(f"⚠️  {name}: loudness dell'album non misurabile")
+            for file in tracks:
+                albums[file] = album
+            if not (self.incremental and all(self.is_done(file) for file in tracks)):
+                pending.extend(tracks)
+        
+        skipped = len(measurements) - len(pending)
+        with self.lock:
+            self.summary['albums'] = len(groups)
+            self.summary['skipped'] += skipped
+            self.summary['total'] -= skipped
+            for file in set(measurements) - set(pending):
+                self.partial.pop(str(file), None)
+        if self.incremental:
+            self.log(f"⏭  Album già normalizzati (tracce saltate): {skipped}")
+        
+        for file, future in self.scheduler.run(
+                pending, lambda file: self.process_single_file(file, measurements[file], albums[file])):
+            self.collect(file, future)
+    
+    def run_coordinator(self):
+        """Coordinatore: accoda i file trovati, attende i worker e aggrega i loro report
+        
+        Senza --incremental i job già completati vengono rielaborati; i file
+        nuovi, modificati o falliti tornano comunque in coda.
+        """
+        batch = []
+        for file in self.iter_jobs(skip_done=False):
+            try:
+                st = file.stat()
+            except OSError as e:
+                self.reject(file, f'file non accessibile: {e.strerror or e}')
+                continue
+            batch.append((file.relative_to(self.input_dir).as_posix(), st.st_size,
+                          st.st_mtime_ns, self.scheduler.job_cost(file)))
+            if len(batch) >= 500:
+                self.work_queue.add(batch, reset=not self.incremental)
+                batch = []
+        self.work_queue.add(batch, reset=not self.incremental)
+        self.log(f"📡 Coda: {self.work_queue.db_path}")
+        
+        # Attesa: avanzamento dalla coda finché non restano job da elaborare
+        last = None
+        while not self.cancelled.wait(2.0):
+            progress = self.work_queue.progress()
+            finished = progress['done'] + progress['failed']
+            total = finished + progress['pending'] + progress['leased']
+            if progress != last:
+                self.log(f"📡 {finished}/{total} completati, {progress['leased']} in corso, "
+                         f"worker attivi: {progress['workers']}")
+                last = progress
+                if self.progress_callback:
+                    self.progress_callback(finished, total)
+            if not progress['pending'] and not progress['leased']:
+                break
+        
+        # Riepilogo unico: i report dei worker passano per la stessa aggregazione
+        # dei job locali (i file scartati dalla scansione sono già registrati)
+        results = self.work_queue.results()
+        with self.lock:
+            self.summary['total'] = self.summary['rejected'] + len(results)
+            if self.cancelled.is_set():
+                progress = self.work_queue.progress()
+                self.summary['cancelled'] = progress['pending'] + progress['leased']
+        for report in results:
+            worker = report.get('worker')
+            if worker:
+                workers = self.summary['workers']
+                workers[worker] = workers.get(worker, 0) + 1
+            self.record(report)
+    
+    def run_worker(self):
+        """Worker: prende job dalla coda finché ce ne sono, un thread per worker
+        
+        Un heartbeat rinnova i lease mentre i job sono in corso; i job annullati
+        tornano in coda per gli altri worker.
+        """
+        work_queue = self.work_queue
+        stop = threading.Event()
+        
+        def heartbeat():
+            while not stop.wait(work_queue.LEASE_SECONDS / 4):
+                work_queue.heartbeat(self.worker_id, self.completed)
+        
+        def work():
+            while not self.cancelled.is_set():
+                path = work_queue.claim(self.worker_id)
+                if path is None:
+                    progress = work_queue.progress()
+                    if not progress['pending'] and not progress['leased']:
+                        return
+                    # Job in lease ad altri worker: potrebbero scadere e tornare disponibili
+                    self.cancelled.wait(5.0)
+                    continue
+                with self.lock:
+                    self.summary['total'] += 1
+                file = self.input_dir / path
+                try:
+                    report = self.process_single_file(file)
+                except Exception as e:
+                    self.log(f"✗ Errore critico per {file.name}: {e}")
+                    report = {'input': str(file), 'output': None, 'action': None,
+                              'status': 'failed', 'error': str(e)}
+                report['worker'] = self.worker_id
+                if report['status'] == 'cancelled':
+                    work_queue.release(path, self.worker_id)
+                elif not work_queue.complete(path, self.worker_id, report):
+                    self.log(f"⚠️  {file.name}: lease scaduto, il job è passato a un altro worker")
+                self.record(report)
+        
+        self.log(f"📡 Worker {self.worker_id} sulla coda {work_queue.db_path}")
+        work_queue.heartbeat(self.worker_id)
+        threading.Thread(target=heartbeat, daemon=True).start()
+        try:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.scheduler.max_workers) as executor:
+                for future in [executor.submit(work) for _ in range(self.scheduler.max_workers)]:
+                    future.result()
+        finally:
+            stop.set()
+            work_queue.heartbeat(self.worker_id, self.completed)
+    
+    def measure_track(self, file: Path) -> Tuple[dict, Optional[LoudnessStats]]:
+        """Fase 1 della modalità album: misura (o legge dalla cache) una traccia"""
+        report = {'input': str(file), 'output': None, 'action': None}
+        if self.cancelled.is_set():
+            return report, None
+        report['queue_wait'] = round(self.scheduler.queue_wait.pop(file, 0.0), 3)
+        try:
+            report['duration'] = self.normalizer.get_duration(self.normalizer.probe_file(file))
+            stats = self.normalizer.get_loudness_stats(file, self.ffmpeg_path, report=report)
+        except (subprocess.TimeoutExpired, JobCancelled):
+            stats = None
+        except Exception as e:
+            self.log(f"✗ Errore analisi {file.name}: {e}")
+            stats = None
+        return report, stats
+    
+    def album_key(self, file: Path) -> str:
+        """Nome del gruppo album: tag album (+ album artist) o cartella del file"""
+        folder = file.parent.relative_to(self.input_dir).as_posix()
+        folder = 'cartella principale' if folder == '.' else folder
+        if self.normalizer.album_mode == 'tag':
+            tags = self.normalizer.get_album_tags(self.normalizer.probe_file(file))
+            if 'album' in tags:
+                # Senza album artist, album omonimi di cartelle diverse restano separati
+                return f"{tags['album']} ({tags.get('albumartist', folder)})"
+        return folder
+    
+    def log_timing(self):
+        """Tempo per fase e file più lenti nel log"""
+        summary = self.summary
+        if summary['verify_retried'] or summary['verify_flagged'] or summary['verify_failed']:
+            self.log(f"\n🔍 Verifica output: {summary['verify_retried']} rifatti, "
+                     f"{summary['verify_flagged']} con loudness anomalo, "
+                     f"{summary['verify_failed']} scartati")
+        if summary['stages']:
+            self.log("\n⏱  Tempo per fase (somma sui worker):")
+            for stage, totals in sorted(summary['stages'].items(),
+                                        key=lambda item: -item[1]['wall']):
+                cpu = f", CPU {totals['cpu']:.1f}s" if totals['cpu'] else ""
+                self.log(f"  {stage:<12} {totals['wall']:8.1f}s{cpu} ({totals['count']}×)")
+            self.log(f"  {'coda':<12} {summary['queue_wait']:8.1f}s "
+                     f"(attesa del pool: {summary['pool_wait']:.1f}s)")
+        if summary['slowest']:
+            self.log("🐢 File più lenti:")
+            for entry in summary['slowest'][:5]:
+                duration = f" (durata {entry['duration']:.0f}s)" if entry.get('duration') else ""
+                self.log(f"  {entry['elapsed']:7.1f}s  {Path(entry['input']).name}{duration}")
+    
+    def write_report(self, path: Path):
+        """Scrive il report dell'esecuzione: JSON (riepilogo + file) o CSV (una riga per fase)"""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.suffix.lower() == '.csv':
+            import csv
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=self.CSV_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                for report in self.reports:
+                    for stage in report.get('stages') or [{}]:
+                        writer.writerow({**report, **stage})
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({'summary': self.summary, 'files': self.reports}, f,
+                          ensure_ascii=False, indent=2)
+    
+    def iter_jobs(self, skip_done: bool = True):
+        """Scansione + filtro incrementale + indicizzazione, in streaming
+        
+        Con `skip_done` False (modalità album) anche i file già normalizzati
+        vengono restituiti: le loro misure servono al guadagno dell'album.
+        """
+        found = self.normalizer.iter_audio_files(
+            self.input_dir, recursive=self.recursive,
+            include=self.include, exclude=self.exclude,
+            follow_symlinks=self.follow_symlinks,
+            # L'output può stare dentro l'input: non rielaborarlo
+            skip_dirs=(self.output_dir,),
+            on_error=lambda path, e: self.log(f"⚠️  Impossibile leggere {path}: {e}")
+        )
+        
+        def pending():
+            for file in found:
+                # Annullamento: la scansione si ferma
+                if self.cancelled.is_set():
+                    break
+                # Modalità incrementale: solo file nuovi, modificati o falliti
+                try:
+                    done = skip_done and self.incremental and self.manifest.is_done(file, self.params)
+                except OSError as e:
+                    # File sparito o illeggibile dopo la scansione: scartato solo lui
+                    with self.lock:
+                        self.summary['total'] += 1
+                    self.reject(file, f'file non accessibile: {e.strerror or e}')
+                    continue
+                if done:
+                    with self.lock:
+                        self.summary['skipped'] += 1
+                    continue
+                with self.lock:
+                    self.summary['total'] += 1
+                yield file
+        
+        start = time.perf_counter()
+        if self.normalizer.index is None:
+            yield from pending()
+        else:
+            # Indicizzazione: un ffprobe leggero per file, in parallelo e con
+            # una finestra limitata per non anticipare troppo la scansione
+            for file, probe in self.probe_stream(pending()):
+                if self.normalizer.get_audio_stream(probe) is None:
+                    self.reject(file, 'file non leggibile' if probe is None else 'nessuno stream audio')
+                    continue
+                with self.lock:
+                    self.summary['total_duration'] += self.normalizer.get_duration(probe) or 0.0
+                yield file
+        
+        self.scanning = False
+        total = int(self.summary['total_duration'])
+        self.log(f"\n🔎 Scansione completata in {time.perf_counter() - start:.1f}s: "
+                 f"{self.summary['total']} file da elaborare"
+                 + (f", durata audio {total // 3600}:{total % 3600 // 60:02d}:{total % 60:02d}"
+                    if total else ""))
+        if skip_done and self.incremental:
+            self.log(f"⏭  Già normalizzati (saltati): {self.summary['skipped']}")
+        if self.start_callback:
+            self.start_callback(self.summary['total'])
+    
+    def is_done(self, file: Path) -> bool:
+        """Già normalizzato secondo il manifest (un file sparito nel frattempo non lo è)"""
+        try:
+            return self.manifest.is_done(file, self.params)
+        except OSError:
+            return False
+    
+    def reject(self, file: Path, reason: str):
+        """Scarta un file durante la scansione (conteggiato e riportato come fallito)"""
+        self.log(f"✗ Scartato {file.name}: {reason}")
+        with self.lock:
+            self.summary['rejected'] += 1
+        self.record({'input': str(file), 'output': None, 'action': 'rejected',
+                     'status': 'failed', 'error': reason})
+    
+    def probe_stream(self, files):
+        """(file, probe) in ordine, con al massimo 2×worker ffprobe in corso"""
+        window = self.scheduler.max_workers * 2
+        def probe(file):
+            start = time.perf_counter()
+            try:
+                return self.normalizer.probe_file(file)
+            finally:
+                self.add_stage({'stage': 'probe', 'wall': time.perf_counter() - start,
+                                'cpu': None, 'bytes_read': 0, 'bytes_written': 0})
+        
+        with concurrent.futures.ThreadPoolExecutor(max_workers=window) as executor:
+            pending = collections.deque()
+            for file in files:
+                pending.append((file, executor.submit(probe, file)))
+                if len(pending) >= window:
+                    file, future = pending.popleft()
+                    yield file, future.result()
+            while pending:
+                file, future = pending.popleft()
+                yield file, future.result()
+    
+    def process_single_file(self, file: Path,
+                            measurement: Optional[Tuple[dict, Optional[LoudnessStats]]] = None,
+                            album: Optional[dict] = None) -> dict:
+        """Processa un singolo file e ritorna il risultato
+        
+        In modalità album `measurement` è il risultato di `measure_track()`: il
+        report della fase 1 (con i tempi dell'analisi) prosegue qui.
+        """
+        # Rispecchia l'albero delle cartelle sorgente nell'output
+        output_file = self.output_dir / file.relative_to(self.input_dir)
+        output_file.parent.mkdir(parents=True, exist_ok=True)
+        report, stats = measurement or ({'input': str(file), 'output': None, 'action': None}, None)
+        if self.cancelled.is_set():
+            # In coda al momento dell'annullamento: non viene avviato
+            report.update(status='cancelled', error='annullato')
+            return report
+        if self.normalizer.index is not None:
+            report['duration'] = self.normalizer.get_duration(self.normalizer.probe_file(file))
+        report['queue_wait'] = round(report.get('queue_wait', 0.0)
+                                     + self.scheduler.queue_wait.pop(file, 0.0), 3)
+        start = time.perf_counter()
+        if self.manifest is not None:
+            self.manifest.mark(file, self.params, 'running')
+        if measurement is not None and stats is None:
+            # Misura della fase 1 fallita: non si rianalizza
+            self.log(f"✗ {file.name}: loudness non misurabile")
+            report['error'] = 'loudness non misurabile'
+            ok = False
+        else:
+            ok = self.normalizer.normalize_file(
+                file, output_file, self.ffmpeg_path,
+                log_callback=self.log_callback, report=report, stats=stats, album=album
+            )
+        if ok:
+            status = 'done'
+        else:
+            status = 'cancelled' if self.cancelled.is_set() else 'failed'
+        # I file annullati non risultano completati: riprovati al prossimo avvio incrementale
+        if self.manifest is not None:
+            self.manifest.mark(file, self.params, status,
+                               Path(report['output']) if report['output'] else None)
+        report['status'] = status
+        report['elapsed'] = round(time.perf_counter() - start, 3)
+        return report
+    
+    def add_stage(self, stage: dict):
+        """Somma una misura ai totali per fase del riepilogo"""
+        with self.lock:
+            totals = self.summary['stages'].setdefault(stage['stage'], {
+                'count': 0, 'wall': 0.0, 'cpu': 0.0, 'bytes_read': 0, 'bytes_written': 0,
+            })
+            totals['count'] += 1
+            totals['wall'] += stage['wall']
+            totals['cpu'] += stage['cpu'] or 0.0
+            totals['bytes_read'] += stage['bytes_read']
+            totals['bytes_written'] += stage['bytes_written']
+    
+    def record(self, report: dict):
+        """Aggiorna contatori (thread-safe) e notifica risultato e avanzamento"""
+        for stage in report.get('stages', []):
+            self.add_stage(stage)
+        with self.lock:
+            self.completed += 1
+            self.partial.pop(report['input'], None)
+            self.summary[{'done': 'success', 'cancelled': 'cancelled'}.get(
+                report['status'], 'failed')] += 1
+            self.summary['queue_wait'] += report.get('queue_wait', 0.0)
+            # Output sospetti: rifatti, segnalati (loudness) o scartati
+            verify_status = report.get('verify', {}).get('status', 'ok')
+            if verify_status != 'ok':
+                self.summary[f'verify_{verify_status}'] += 1
+            if self.report_path is not None:
+                self.reports.append(report)
+            # I file più lenti (heap di dimensione fissa)
+            if 'elapsed' in report:
+                entry = (report['elapsed'], self.completed, {
+                    'input': report['input'], 'elapsed': report['elapsed'],
+                    'duration': report.get('duration'), 'action': report['action'],
+                })
+                if len(self.slowest) < self.SLOWEST_FILES:
+                    heapq.heappush(self.slowest, entry)
+                else:
+                    heapq.heappushpop(self.slowest, entry)
+            done, total = self.completed, self.summary['total']
+        if self.result_callback:
+            self.result_callback(report)
+        if self.progress_callback:
+            self.progress_callback(done, total)
+
+
+# Tkinter si importa solo per la GUI (import_tkinter): la modalità headless
+# parte più in fretta e non richiede Tk installato
+tk = ttk = scrolledtext = messagebox = None
+
+
+def import_tkinter():
+    """Importa Tkinter nei nomi globali usati da NormalizerGUI"""
+    global tk, ttk, scrolledtext, messagebox
+    import tkinter as tk
+    from tkinter import ttk, scrolledtext, messagebox
 
 
 class NormalizerGUI:
+    # Righe massime nel widget di log (il log completo va su file)
+    LOG_MAX_LINES = 5000
+    # Messaggi elaborati al massimo per ciclo della coda
+    LOG_BATCH = 10000
+    
     def __init__(self, root):
         self.root = root
         self.root.title("NORMALIZZATORE MUSICALE")
@@ -255,8 +3219,14 @@ class NormalizerGUI:
         
         # Variabili
         self.normalizer = None
+        self.engine = None
         self.processing = False
         self.log_queue = queue.Queue()
+        self.log_file = None
+        # Contatori aggregati dell'elaborazione (aggiornati una volta per ciclo)
+        self.counters = collections.Counter()
+        self.audio_done = 0.0
+        self.run_start = None
         
         self.setup_ui()
         # Check ffmpeg in background to avoid blocking startup
@@ -296,18 +3266,65 @@ class NormalizerGUI:
         )
         target_combo.grid(row=0, column=1, sticky=(tk.W, tk.E), padx=(10, 0))
         
+        # Modalità di normalizzazione
+        ttk.Label(control_frame, text="Modalità:").grid(row=1, column=0, sticky=tk.W, pady=(10, 0))
+        
+        self.mode_var = tk.StringVar(value="Loudnorm two-pass")
+        mode_combo = ttk.Combobox(control_frame, textvariable=self.mode_var,
+                                  state='readonly', width=30)
+        mode_combo['values'] = (
+            'Loudnorm two-pass',
+            'Solo guadagno (più veloce)',
+            'Solo tag ReplayGain (nessuna codifica)'
+        )
+        mode_combo.grid(row=1, column=1, sticky=(tk.W, tk.E), padx=(10, 0), pady=(10, 0))
+        
+        # Modalità incrementale
+        self.incremental_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="Modalità incrementale (salta i file già normalizzati)",
+                        variable=self.incremental_var).grid(row=2, column=0, columnspan=2,
+                                                            sticky=tk.W, pady=(10, 0))
+        
+        # Sottocartelle (l'albero viene rispecchiato in 'normalized/')
+        self.recursive_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="Includi sottocartelle",
+                        variable=self.recursive_var).grid(row=3, column=0, columnspan=2,
+                                                          sticky=tk.W, pady=(5, 0))
+        
+        # Modalità album: stesso guadagno per tutte le tracce di una cartella
+        self.album_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="Modalità album (guadagno comune per cartella)",
+                        variable=self.album_var).grid(row=4, column=0, columnspan=2,
+                                                      sticky=tk.W, pady=(5, 0))
+        
+        # Duplicati: una sola elaborazione per contenuto, gli altri output sono hardlink
+        self.dedup_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(control_frame, text="Salta i duplicati (stesso audio elaborato una volta)",
+                        variable=self.dedup_var).grid(row=5, column=0, columnspan=2,
+                                                      sticky=tk.W, pady=(5, 0))
+        
         # Status ffmpeg
         self.ffmpeg_status = ttk.Label(control_frame, text="⏳ Verifica ffmpeg in corso...", foreground='gray')
-        self.ffmpeg_status.grid(row=1, column=0, columnspan=2, sticky=tk.W, pady=(10, 0))
+        self.ffmpeg_status.grid(row=6, column=0, columnspan=2, sticky=tk.W, pady=(10, 0))
         
         # Pulsante avvio (inizialmente disabilitato fino al check ffmpeg)
-        self.start_btn = ttk.Button(control_frame, text="▶ Avvia Normalizzazione", 
+        button_frame = ttk.Frame(control_frame)
+        button_frame.grid(row=7, column=0, columnspan=2, pady=(15, 0))
+        self.start_btn = ttk.Button(button_frame, text="▶ Avvia Normalizzazione", 
                                     command=self.start_processing, state='disabled')
-        self.start_btn.grid(row=2, column=0, columnspan=2, pady=(15, 0))
+        self.start_btn.grid(row=0, column=0)
+        # Annulla: termina i processi ffmpeg in corso
+        self.cancel_btn = ttk.Button(button_frame, text="⏹ Annulla",
+                                     command=self.cancel_processing, state='disabled')
+        self.cancel_btn.grid(row=0, column=1, padx=(10, 0))
         
         # Progress bar
         self.progress = ttk.Progressbar(control_frame, mode='indeterminate')
-        self.progress.grid(row=3, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(10, 0))
+        self.progress.grid(row=8, column=0, columnspan=2, sticky=(tk.W, tk.E), pady=(10, 0))
+        
+        # Contatori, velocità e tempo stimato
+        self.stats_label = ttk.Label(control_frame, text="", foreground='gray')
+        self.stats_label.grid(row=9, column=0, columnspan=2, sticky=tk.W, pady=(5, 0))
         
         # Log area
         log_frame = ttk.LabelFrame(main_frame, text="Log", padding="5")
@@ -341,7 +3358,7 @@ class NormalizerGUI:
         # Update UI from main thread using root.after()
         if available:
             self.root.after(0, lambda: self.ffmpeg_status.config(
-                text=f"✓ ffmpeg disponibile", 
+                text="✓ ffmpeg disponibile", 
                 foreground='green'
             ))
             self.root.after(0, lambda: self.start_btn.config(state='normal'))
@@ -364,22 +3381,86 @@ class NormalizerGUI:
         self.log_queue.put(message)
     
     def process_log_queue(self):
-        """Processa messaggi dal thread worker"""
+        """Svuota la coda a blocchi: un solo inserimento nel widget per ciclo"""
+        lines = []
+        progress = None
         try:
-            while True:
+            for _ in range(self.LOG_BATCH):
                 message = self.log_queue.get_nowait()
-                # Gestisci aggiornamento progress bar
-                if isinstance(message, tuple) and message[0] == '__progress__':
-                    self.progress['value'] = message[1]
-                else:
-                    self.log_text.insert(tk.END, message + "\n")
-                    self.log_text.see(tk.END)
-                    self.log_text.update()
+                if not isinstance(message, tuple):
+                    lines.append(message)
+                elif message[0] == '__start__':
+                    self.progress.stop()
+                    self.progress.config(mode='determinate', maximum=message[1], value=0)
+                    progress = None
+                elif message[0] == '__progress__':
+                    # Conta solo l'ultimo avanzamento del ciclo
+                    progress = message
+                elif message[0] == '__result__':
+                    self.counters[message[1]] += 1
+                    self.audio_done += message[2] or 0.0
+                elif message[0] == '__finish__':
+                    self.progress.stop()
+                    self.start_btn.config(state='normal')
+                    self.cancel_btn.config(state='disabled')
+                elif message[0] == '__log_file__':
+                    self.append_log(lines)
+                    lines = []
+                    self.set_log_file(message[1])
         except queue.Empty:
             pass
         finally:
+            self.append_log(lines)
+            if progress is not None:
+                self.update_progress(*progress[1:])
             self.root.after(100, self.process_log_queue)
     
+    def append_log(self, lines: List[str]):
+        """Aggiunge righe al log su file e al widget, che tiene solo le ultime LOG_MAX_LINES"""
+        if not lines:
+            return
+        text = "\n".join(lines) + "\n"
+        if self.log_file is not None:
+            self.log_file.write(text)
+        self.log_text.insert(tk.END, text)
+        line_count = int(self.log_text.index('end-1c').split('.')[0])
+        if line_count > self.LOG_MAX_LINES:
+            self.log_text.delete('1.0', f'{line_count - self.LOG_MAX_LINES + 1}.0')
+        self.log_text.see(tk.END)
+    
+    def set_log_file(self, path: Optional[Path]):
+        """Apre (o chiude, con None) il file che riceve il log completo"""
+        if self.log_file is not None:
+            self.log_file.close()
+            self.log_file = None
+        if path is not None:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self.log_file = open(path, 'w', encoding='utf-8')
+    
+    def update_progress(self, completed: float, total: Optional[int] = None):
+        """Progress bar e riga dei contatori con velocità e tempo stimato"""
+        # Il totale cresce durante la scansione
+        if total is not None and str(self.progress['mode']) == 'determinate':
+            self.progress['maximum'] = max(total, 1)
+        self.progress['value'] = completed
+        if self.run_start is None:
+            return
+        
+        elapsed = max(time.monotonic() - self.run_start, 1e-6)
+        parts = [f"✓ {self.counters['done']}", f"✗ {self.counters['failed']}"]
+        if self.counters['cancelled']:
+            parts.append(f"⏹ {self.counters['cancelled']}")
+        if total:
+            parts.append(f"{int(completed)}/{total}")
+        rate = completed / elapsed
+        parts.append(f"{rate * 60:.1f} file/min")
+        if self.audio_done:
+            parts.append(f"{self.audio_done / elapsed:.0f}× tempo reale")
+        if total and rate > 0 and completed < total:
+            eta = int((total - completed) / rate)
+            parts.append(f"ETA {eta // 3600}:{eta % 3600 // 60:02d}:{eta % 60:02d}")
+        self.stats_label.config(text="  ·  ".join(parts))
+    
     def get_target_lufs(self) -> float:
         """Converte selezione in valore LUFS"""
         target_map = {
@@ -389,6 +3470,15 @@ class NormalizerGUI:
         }
         return target_map.get(self.target_var.get(), -16.0)
     
+    def get_mode(self) -> str:
+        """Converte selezione in modalità di normalizzazione"""
+        mode_map = {
+            'Loudnorm two-pass': 'loudnorm',
+            'Solo guadagno (più veloce)': 'gain',
+            'Solo tag ReplayGain (nessuna codifica)': 'tags'
+        }
+        return mode_map.get(self.mode_var.get(), 'loudnorm')
+    
     def start_processing(self):
         """Avvia elaborazione in thread separato"""
         if self.processing:
@@ -407,111 +3497,108 @@ class NormalizerGUI:
         
         self.processing = True
         self.start_btn.config(state='disabled')
+        self.cancel_btn.config(state='normal')
+        self.counters = collections.Counter()
+        self.audio_done = 0.0
+        self.run_start = time.monotonic()
+        self.stats_label.config(text="")
         self.progress.start()
         
         # Avvia thread
         thread = threading.Thread(target=self.process_files, daemon=True)
         thread.start()
     
+    def cancel_processing(self):
+        """Annulla l'elaborazione in corso"""
+        if self.engine is not None:
+            self.cancel_btn.config(state='disabled')
+            self.engine.cancel()
+    
     def process_files(self):
         """Elabora tutti i file in parallelo (eseguito in thread separato)"""
         try:
             # Setup
             target_lufs = self.get_target_lufs()
             self.normalizer = MusicNormalizer(target_lufs=target_lufs)
+            self.normalizer.mode = self.get_mode()
+            self.normalizer.album_mode = 'dir' if self.album_var.get() else None
             
             # Trova ffmpeg
+            # Probe in cache dalla verifica all'avvio: nessun processo ffmpeg qui
             available, ffmpeg_path = self.normalizer.check_ffmpeg()
             if not available:
                 self.log("\n✗ ffmpeg non disponibile!")
                 return
+            unsupported = self.normalizer.check_capabilities()
+            if unsupported is not None:
+                self.log(f"\n✗ {unsupported}")
+                return
             
             # Cartelle
             script_dir = Path(sys.executable if getattr(sys, 'frozen', False) 
                             else __file__).parent
             output_dir = script_dir / "normalized"
-            output_dir.mkdir(exist_ok=True)
+            # Log completo su file: il widget conserva solo le ultime righe
+            self.log_queue.put(('__log_file__', output_dir / "run_log.txt"))
             
-            # Trova file
-            audio_files = self.normalizer.get_audio_files(script_dir)
+            def on_start(total):
+                # Scansione completata: progress bar determinata (via queue,
+                # i widget si toccano solo dal thread di Tk)
+                self.log_queue.put(('__start__', total))
             
-            if not audio_files:
-                self.log("\n✗ Nessun file audio/video trovato nella cartella!")
-                self.log(f"\nCercato in: {script_dir}")
-                return
+            def on_progress(completed, total):
+                # Aggiorna progress bar via queue
+                self.log_queue.put(('__progress__', completed, total))
             
-            # Numero di worker = numero di CPU
-            max_workers = os.cpu_count() or 4
-            
-            self.log(f"\n{'='*60}")
-            self.log("AVVIO ELABORAZIONE PARALLELA")
-            self.log(f"{'='*60}")
-            self.log(f"Cartella: {script_dir}")
-            self.log(f"Output: {output_dir}")
-            self.log(f"Target: {target_lufs} LUFS")
-            self.log(f"File trovati: {len(audio_files)}")
-            self.log(f"🚀 Worker paralleli: {max_workers} (CPU cores)")
-            self.log(f"{'='*60}")
-            
-            # Configura progress bar determinata
-            self.progress.config(mode='determinate', maximum=len(audio_files), value=0)
+            self.engine = engine = BatchEngine(
+                self.normalizer, ffmpeg_path, script_dir, output_dir,
+                incremental=self.incremental_var.get(),
+                recursive=self.recursive_var.get(),
+                # Cache misure accanto a 'normalized/'
+                cache_path=script_dir / ".loudness_cache.db",
+                index_path=script_dir / ".library_index.db",
+                # Tempi per fase di ogni file, per capire dove si perde tempo
+                report_path=output_dir / "run_report.json",
+                dedup='link' if self.dedup_var.get() else None,
+                log_callback=self.log,
+                start_callback=on_start,
+                progress_callback=on_progress,
+                result_callback=lambda report: self.log_queue.put(
+                    ('__result__', report['status'], report.get('duration'))),
+            )
+            summary = engine.run()
             
-            # Contatori thread-safe
-            completed = [0]  # Lista per mutabilità in closure
-            success = [0]
-            failed = [0]
-            lock = threading.Lock()
+            if summary['total'] == 0:
+                return
             
-            def process_single_file(file: Path) -> Tuple[Path, bool]:
-                """Processa un singolo file e ritorna risultato"""
-                output_file = output_dir / file.name
-                result = self.normalizer.normalize_file(
-                    file, output_file, ffmpeg_path, log_callback=self.log
+            if summary['cancelled'] > 0:
+                messagebox.showinfo(
+                    "Annullato",
+                    f"Elaborazione annullata.\n\n"
+                    f"Completati: {summary['success']}/{summary['total']}\n"
+                    f"Non completati: {summary['cancelled']}"
                 )
-                
-                # Aggiorna contatori thread-safe
-                with lock:
-                    completed[0] += 1
-                    if result:
-                        success[0] += 1
-                    else:
-                        failed[0] += 1
-                    # Aggiorna progress bar via queue
-                    self.log_queue.put(('__progress__', completed[0]))
-                
-                return file, result
-            
-            # Elaborazione parallela con ThreadPoolExecutor
-            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
-                # Sottometti tutti i job
-                futures = {executor.submit(process_single_file, f): f for f in audio_files}
-                
-                # Attendi completamento
-                for future in concurrent.futures.as_completed(futures):
-                    file = futures[future]
-                    try:
-                        _, ok = future.result()
-                    except Exception as e:
-                        self.log(f"✗ Errore critico per {file.name}: {e}")
-                        with lock:
-                            failed[0] += 1
-                            completed[0] += 1
+                return
             
             # Report finale
             self.log(f"\n{'='*60}")
             self.log("✓ ELABORAZIONE COMPLETATA")
             self.log(f"{'='*60}")
-            self.log(f"Successi: {success[0]}/{len(audio_files)}")
-            if failed[0] > 0:
-                self.log(f"Falliti: {failed[0]}/{len(audio_files)}")
+            self.log(f"Successi: {summary['success']}/{summary['total']}")
+            if summary['failed'] > 0:
+                self.log(f"Falliti: {summary['failed']}/{summary['total']}")
+            if summary['skipped'] > 0:
+                self.log(f"Saltati (già normalizzati): {summary['skipped']}")
+            self.log(f"Cache misure: {summary['cache_hits']} hit, {summary['cache_misses']} miss")
             self.log(f"\nFile salvati in: {output_dir}")
+            self.log(f"Log completo: {output_dir / 'run_log.txt'}")
             self.log(f"{'='*60}\n")
             
             messagebox.showinfo(
                 "Completato",
                 f"Elaborazione completata!\n\n"
-                f"Successi: {success[0]}/{len(audio_files)}\n"
-                f"Falliti: {failed[0]}\n\n"
+                f"Successi: {summary['success']}/{summary['total']}\n"
+                f"Falliti: {summary['failed']}\n\n"
                 f"File salvati in:\n{output_dir}"
             )
             
@@ -520,12 +3607,240 @@ class NormalizerGUI:
             messagebox.showerror("Errore", f"Errore durante elaborazione:\n{str(e)}")
         
         finally:
+            self.log_queue.put(('__log_file__', None))
             self.processing = False
-            self.progress.stop()
-            self.start_btn.config(state='normal')
+            self.engine = None
+            self.log_queue.put(('__finish__',))
+
+
+# Exit code della modalità CLI
+EXIT_OK = 0
+EXIT_FAILURES = 1
+EXIT_ERROR = 2
+EXIT_CANCELLED = 130
+
+
+def run_cli(argv: List[str]) -> int:
+    """Modalità headless: elabora una cartella senza GUI, risultati JSON lines su stdout"""
+    import argparse
+    
+    parser = argparse.ArgumentParser(
+        prog='normalize_music',
+        description='Normalizzazione loudness (EBU R128) di file audio/video senza GUI. '
+                    'Un risultato JSON per riga su stdout, log su stderr.'
+    )
+    parser.add_argument('-i', '--input', type=Path,
+                        help='cartella con i file audio/video (un worker usa quella del coordinatore)')
+    parser.add_argument('-o', '--output', type=Path,
+                        help="cartella di output (default: <input>/normalized)")
+    parser.add_argument('-r', '--recursive', action='store_true',
+                        help="cerca anche nelle sottocartelle (l'albero viene rispecchiato nell'output)")
+    parser.add_argument('--include', action='append', metavar='GLOB',
+                        help='elabora solo i file che corrispondono (ripetibile)')
+    parser.add_argument('--exclude', action='append', metavar='GLOB',
+                        help='escludi file o cartelle che corrispondono (ripetibile)')
+    parser.add_argument('--follow-symlinks', action='store_true',
+                        help='segui i link simbolici durante la scansione')
+    parser.add_argument('-t', '--target', type=float, default=-16.0,
+                        help='loudness integrato target in LUFS (default: -16)')
+    parser.add_argument('--tp', type=float, default=-1.5,
+                        help='true peak massimo in dBTP (default: -1.5)')
+    parser.add_argument('--lra', type=float, default=11.0,
+                        help='loudness range target in LU (default: 11)')
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='numero di worker paralleli (default: numero di CPU)')
+    parser.add_argument('--video-jobs', type=int, default=None,
+                        help='massimo di estrazioni da video simultanee (default: worker/4)')
+    parser.add_argument('-c', '--codec', choices=sorted(MusicNormalizer.OUTPUT_CODECS),
+                        default=None, help='codec di output (default: mantieni il formato)')
+    parser.add_argument('--sample-rate', default='source',
+                        help="sample rate di output: 'source' (come la sorgente, default) "
+                             "o un valore in Hz, es. 48000")
+    parser.add_argument('-m', '--mode', choices=('loudnorm', 'gain', 'tags'), default='loudnorm',
+                        help="loudnorm: two-pass (default); gain: volume statico quando il "
+                             "true peak lo consente; tags: solo tag ReplayGain/R128")
+    parser.add_argument('--album', nargs='?', const='dir', choices=('dir', 'tag'), default=None,
+                        help="modalità album: un solo guadagno per gruppo di tracce, "
+                             "raggruppate per cartella (dir, default) o per tag album "
+                             "(tag, richiede ffprobe; senza tag vale la cartella)")
+    parser.add_argument('--dedup', nargs='?', const='link', choices=('link', 'copy'), default=None,
+                        help="elabora una sola volta i file con lo stesso contenuto audio: "
+                             "gli altri output sono hardlink (link, default; copia tra file "
+                             "system diversi) o copie (copy) dell'output dell'originale")
+    parser.add_argument('--analysis-engine', choices=('loudnorm', 'numpy'), default='loudnorm',
+                        help='motore di misura: filtro loudnorm di ffmpeg (default) o '
+                             'analizzatore EBU R128 in-process con NumPy')
+    parser.add_argument('--decode-once', action='store_true',
+                        help='decodifica ogni file una sola volta: il PCM dell\'analisi '
+                             'alimenta anche la codifica finale')
+    parser.add_argument('--pcm-memory', type=int, default=512, metavar='MB',
+                        help='memoria massima per i buffer PCM di tutti i worker; '
+                             'oltre si usa il disco (default: 512)')
+    parser.add_argument('--scratch-dir', type=Path, default=None,
+                        help='cartella per i buffer PCM su disco (default: temp di sistema)')
+    parser.add_argument('--verify', choices=('off', 'metadata', 'loudness'), default='metadata',
+                        help="verifica degli output: durata, stream e dimensione da ffprobe "
+                             "(metadata, default), anche loudness di pochi segmenti "
+                             "(loudness) o nessuna (off); gli output sospetti vengono rifatti")
+    parser.add_argument('--incremental', action='store_true',
+                        help='elabora solo i file nuovi, modificati o falliti')
+    parser.add_argument('--cache', type=Path, default=None,
+                        help='database cache misure (default: <output>/.loudness_cache.db)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="disattiva la cache delle misure e l'indice ffprobe")
+    parser.add_argument('--cache-content-hash', action='store_true',
+                        help='riconosce dal contenuto (hash BLAKE2b) i file spostati, rinominati '
+                             'o con mtime cambiato; ogni file misurato viene letto per intero')
+    parser.add_argument('--cache-max-entries', type=int, default=200000, metavar='N',
+                        help='voci massime della cache misure, le meno usate vengono rimosse '
+                             '(default: 200000)')
+    parser.add_argument('--cache-max-age-days', type=float, default=180, metavar='DAYS',
+                        help='rimuove le misure non usate da DAYS giorni (default: 180)')
+    parser.add_argument('--report', type=Path, default=None,
+                        help='report dell\'esecuzione con i tempi per fase: .json o .csv')
+    distributed = parser.add_mutually_exclusive_group()
+    distributed.add_argument('--coordinator', type=Path, metavar='QUEUE',
+                             help='accoda i file nel database QUEUE (su storage condiviso), '
+                                  'attende i worker e aggrega i loro report')
+    distributed.add_argument('--worker', type=Path, metavar='QUEUE',
+                             help='elabora i job della coda QUEUE con i parametri del '
+                                  'coordinatore (-i/-o solo se i percorsi sono montati altrove)')
+    parser.add_argument('-q', '--quiet', action='store_true',
+                        help='nessun log su stderr')
+    args = parser.parse_args(argv)
+    
+    def log(message):
+        if not args.quiet:
+            print(message, file=sys.stderr, flush=True)
+    
+    # Worker: i parametri del batch arrivano dalla coda, scritti dal coordinatore
+    work_queue = None
+    if args.worker is not None:
+        if not args.worker.is_file():
+            log(f"✗ Coda non trovata: {args.worker}")
+            return EXIT_ERROR
+        work_queue = WorkQueue(args.worker)
+        settings = work_queue.settings()
+        if settings is None:
+            log(f"✗ Coda non inizializzata da un coordinatore: {args.worker}")
+            return EXIT_ERROR
+        args.input = args.input or Path(settings['input'])
+        args.output = args.output or Path(settings['output'])
+        args.target, args.tp, args.lra = settings['target'], settings['tp'], settings['lra']
+        args.mode, args.codec = settings['mode'], settings['codec']
+        args.sample_rate, args.analysis_engine = settings['sample_rate'], settings['analysis_engine']
+    elif args.input is None:
+        parser.error('-i/--input è obbligatorio')
+    if args.album and (work_queue is not None or args.coordinator is not None):
+        log("✗ La modalità album non è disponibile in modalità distribuita")
+        return EXIT_ERROR
+    if args.dedup and (args.album or work_queue is not None or args.coordinator is not None):
+        log("✗ --dedup non è disponibile in modalità album o distribuita")
+        return EXIT_ERROR
+    
+    if not args.input.is_dir():
+        log(f"✗ Cartella di input non trovata: {args.input}")
+        return EXIT_ERROR
+    
+    normalizer = MusicNormalizer(target_lufs=args.target, true_peak=args.tp, lra=args.lra)
+    normalizer.output_codec = args.codec
+    normalizer.mode = args.mode
+    if args.sample_rate != 'source' and not args.sample_rate.isdigit():
+        log(f"✗ Sample rate non valido: {args.sample_rate}")
+        return EXIT_ERROR
+    normalizer.sample_rate_policy = args.sample_rate
+    if args.analysis_engine == 'numpy':
+        import importlib.util
+        if importlib.util.find_spec('numpy') is None:
+            log("✗ Il motore di analisi 'numpy' richiede NumPy (pip install numpy)")
+            return EXIT_ERROR
+    normalizer.analysis_engine = args.analysis_engine
+    normalizer.album_mode = args.album
+    normalizer.verify_output = args.verify
+    normalizer.decode_once = args.decode_once
+    normalizer.pcm_budget = PcmBudget(args.pcm_memory * 1024 * 1024)
+    if args.scratch_dir is not None:
+        args.scratch_dir.mkdir(parents=True, exist_ok=True)
+    normalizer.scratch_dir = args.scratch_dir
+    available, ffmpeg_path = normalizer.check_ffmpeg()
+    if not available:
+        log("✗ ffmpeg non disponibile!")
+        return EXIT_ERROR
+    unsupported = normalizer.check_capabilities()
+    if unsupported is not None:
+        log(f"✗ {unsupported}")
+        return EXIT_ERROR
+    
+    output_dir = args.output or args.input / "normalized"
+    cache_path = None if args.no_cache else (args.cache or output_dir / ".loudness_cache.db")
+    if work_queue is not None and args.cache is None:
+        # La cartella di output è condivisa tra le macchine: cache solo se locale (--cache)
+        cache_path = None
+    index_path = None if cache_path is None else cache_path.with_name(".library_index.db")
+    
+    queue_role = None
+    if args.coordinator is not None:
+        queue_role = 'coordinator'
+        args.coordinator.parent.mkdir(parents=True, exist_ok=True)
+        work_queue = WorkQueue(args.coordinator)
+        work_queue.configure({
+            'input': str(args.input.resolve()), 'output': str(output_dir.resolve()),
+            'target': args.target, 'tp': args.tp, 'lra': args.lra,
+            'mode': args.mode, 'codec': args.codec, 'sample_rate': args.sample_rate,
+            'analysis_engine': args.analysis_engine,
+        })
+    elif work_queue is not None:
+        queue_role = 'worker'
+    
+    print_lock = threading.Lock()
+    
+    def emit(record):
+        with print_lock:
+            print(json.dumps(record, ensure_ascii=False), flush=True)
+    
+    engine = BatchEngine(
+        normalizer, ffmpeg_path, args.input, output_dir,
+        max_workers=args.workers,
+        max_video_jobs=args.video_jobs,
+        incremental=args.incremental,
+        recursive=args.recursive,
+        include=args.include,
+        exclude=args.exclude,
+        follow_symlinks=args.follow_symlinks,
+        cache_path=cache_path,
+        index_path=index_path,
+        cache_options={
+            'max_entries': args.cache_max_entries,
+            'max_age_days': args.cache_max_age_days,
+            'use_content_hash': args.cache_content_hash,
+        },
+        report_path=args.report,
+        dedup=args.dedup,
+        work_queue=work_queue,
+        queue_role=queue_role,
+        log_callback=log,
+        result_callback=lambda report: emit({'type': 'file', **report}),
+    )
+    # Ctrl+C: annulla il batch (processi ffmpeg terminati, riepilogo comunque emesso)
+    signal.signal(signal.SIGINT, lambda signum, frame: engine.cancel())
+    try:
+        summary = engine.run()
+    finally:
+        if work_queue is not None:
+            work_queue.close()
+    emit({'type': 'summary', **summary})
+    
+    if summary['cancelled'] > 0:
+        return EXIT_CANCELLED
+    return EXIT_FAILURES if summary['failed'] > 0 else EXIT_OK
 
 
 def main():
+    # Con argomenti da riga di comando: modalità headless (nessun display necessario)
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
+    
+    import_tkinter()
     root = tk.Tk()
     app = NormalizerGUI(root)
     root.mainloop()
@@ -4,7 +4,7 @@
 a = Analysis(
     ['normalize_music.py'],
     pathex=[],
-    binaries=[('ffmpeg.exe', '.')],
+    binaries=[('ffmpeg.exe', '.'), ('ffprobe.exe', '.')],
     datas=[],
     hiddenimports=[],
     hookspath=[],